@@ -9,7 +9,7 @@ from glob import glob
 modname = 'timeseries'
 distname = 'cubicweb-timeseries'
 
-numversion = (1, 5, 0)
+numversion = (1, 6, 0)
 version = '.'.join(str(num) for num in numversion)
 
 license = 'LCL'
@@ -46,7 +46,7 @@ data_files = [
 ]
 # check for possible extended cube layout
 for dname in ('entities', 'views', 'sobjects', 'hooks', 'schema', 'data',
-              'wdoc', 'i18n', 'migration'):
+              'wdoc', 'i18n', 'migration', 'scripts'):
     if isdir(dname):
         data_files.append([join(THIS_CUBE_DIR, dname), listdir(dname)])
 # Note: here, you'll need to add subdirectories if you want
@@ -0,0 +1,303 @@
+"""process-wide cache of decoded time series arrays
+
+Decoding the stored blobs (see `storage`) is done at most once per process
+for popular series instead of once per request: arrays are kept in a least
+recently used cache bounded by the total size of the cached arrays, keyed by
+(eid, modification date, attribute). Hooks drop the entries of updated or
+deleted entities, the modification date in the key protecting from entries
+re-added by concurrent readers before the commit.
+
+Cached arrays are shared between threads, hence handed out read-only.
+
+Two backends are available:
+
+* `ArrayCache` keeps arrays in the memory of the process,
+
+* `MmapArrayCache` writes them as .npy files in a directory and memory-maps
+  them, so that all processes of a host using the same directory share the
+  same pages.
+
+`setup_array_cache` chooses the backend of `ARRAY_CACHE`, which should hence
+be accessed as a module attribute.
+"""
+import os
+import os.path as osp
+import errno
+import glob
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+class ArrayCache(object):
+    """size-bounded LRU cache of numpy arrays"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._arrays = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, key):
+        return key in self._arrays
+
+    def get(self, key):
+        """return a read-only view on the array cached for `key`, else None"""
+        with self._lock:
+            try:
+                array = self._arrays.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._arrays[key] = array
+            self.hits += 1
+        return array.view()
+
+    def put(self, key, array):
+        """cache `array` for `key` and return a read-only view on it
+
+        Arrays larger than the whole cache are not kept.
+        """
+        array = array.view()
+        array.flags.writeable = False
+        if array.nbytes > self.max_size:
+            return array
+        with self._lock:
+            self._discard(key)
+            self._arrays[key] = array
+            self.size += array.nbytes
+            self._shrink(self.max_size)
+        return array.view()
+
+    def invalidate(self, *eids):
+        """drop every array cached for the given entities"""
+        eids = set(eids)
+        with self._lock:
+            for key in [key for key in self._arrays if key[0] in eids]:
+                self._discard(key)
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            self._shrink(max_size)
+
+    def clear(self):
+        with self._lock:
+            self._arrays.clear()
+            self.size = self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """return a dictionary of usage statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._arrays),
+                    'size': self.size,
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': self.hits / float(lookups) if lookups else 0.,
+                    'evictions': self.evictions}
+
+    # the lock must be held when calling the methods below
+
+    def _discard(self, key):
+        array = self._arrays.pop(key, None)
+        if array is not None:
+            self.size -= array.nbytes
+
+    def _shrink(self, max_size):
+        while self.size > max_size:
+            _key, array = self._arrays.popitem(last=False)
+            self.size -= array.nbytes
+            self.evictions += 1
+
+
+class MmapArrayCache(object):
+    """cache of numpy arrays stored as memory-mapped .npy files in
+    `directory`, possibly shared by several processes
+
+    The total size of the files is bounded by `max_size`, least recently used
+    files being removed first. Processes keep at most `max_maps` arrays mapped
+    (each mapping holds a file descriptor), and check the file still exists
+    before reusing a mapping, hence invalidations are seen by all processes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, max_maps=256):
+        if not osp.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        self.max_maps = max_maps
+        self._lock = threading.Lock()
+        self._maps = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        eid, mdate, attr = key
+        if mdate is not None:
+            mdate = mdate.strftime('%Y%m%d%H%M%S%f')
+        return osp.join(self.directory, '%s-%s-%s.npy' % (eid, mdate, attr))
+
+    def _files(self):
+        return glob.glob(osp.join(self.directory, '*.npy'))
+
+    def __len__(self):
+        return len(self._files())
+
+    def __contains__(self, key):
+        return osp.exists(self._path(key))
+
+    def get(self, key):
+        """return a read-only array mapping the file cached for `key`, else
+        None"""
+        array = self._load(key)
+        with self._lock:
+            if array is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return array
+
+    def put(self, key, array):
+        """write `array` for `key` and return a read-only array mapping it
+
+        Arrays larger than the whole cache are not kept.
+        """
+        if array.nbytes <= self.max_size:
+            fd, tmppath = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as stream:
+                    numpy.save(stream, numpy.ascontiguousarray(array))
+                # atomic, concurrent writers of a key write the same data
+                os.rename(tmppath, self._path(key))
+            except Exception:
+                self._unlink(tmppath)
+                raise
+            self._shrink(self.max_size)
+            mapped = self._load(key)
+            if mapped is not None:
+                return mapped
+        array = array.view()
+        array.flags.writeable = False
+        return array
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            # mark as recently used, and check it has not been invalidated
+            os.utime(path, None)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            with self._lock:
+                self._maps.pop(key, None)
+            return None
+        with self._lock:
+            array = self._maps.pop(key, None)
+        if array is None:
+            try:
+                array = numpy.load(path, mmap_mode='r')
+            except (IOError, OSError, ValueError):
+                # removed meanwhile
+                return None
+        with self._lock:
+            self._maps[key] = array
+            while len(self._maps) > self.max_maps:
+                self._maps.popitem(last=False)
+        return array.view(numpy.ndarray)
+
+    def invalidate(self, *eids):
+        """drop every array cached for the given entities"""
+        eids = set(eids)
+        for eid in eids:
+            for path in glob.glob(osp.join(self.directory, '%s-*.npy' % eid)):
+                self._unlink(path)
+        with self._lock:
+            for key in [key for key in self._maps if key[0] in eids]:
+                del self._maps[key]
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        self._shrink(max_size)
+
+    def clear(self):
+        for path in self._files():
+            self._unlink(path)
+        with self._lock:
+            self._maps.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """return a dictionary of usage statistics (of this process, except
+        for the number of entries and their size)"""
+        files = self._files()
+        lookups = self.hits + self.misses
+        return {'entries': len(files),
+                'size': sum(self._file_size(path) for path in files),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / float(lookups) if lookups else 0.,
+                'evictions': self.evictions,
+                'mapped': len(self._maps)}
+
+    def _shrink(self, max_size):
+        files = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        size = sum(fsize for _mtime, fsize, _path in files)
+        files.sort(reverse=True)
+        while size > max_size and files:
+            _mtime, fsize, path = files.pop()
+            # processes mapping the file keep their pages until they notice
+            self._unlink(path)
+            size -= fsize
+            self.evictions += 1
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+
+ARRAY_CACHE = ArrayCache()
+
+
+def setup_array_cache(backend='memory', max_size=DEFAULT_MAX_SIZE,
+                      directory=None):
+    """set `ARRAY_CACHE` to a new cache using the given backend, either
+    'memory' or 'mmap' (in which case `directory` is required)"""
+    global ARRAY_CACHE
+    if backend == 'mmap':
+        ARRAY_CACHE = MmapArrayCache(directory, max_size)
+    elif backend == 'memory':
+        ARRAY_CACHE = ArrayCache(max_size)
+    else:
+        raise ValueError('unknown time series cache backend %s' % backend)
+    return ARRAY_CACHE
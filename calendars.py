@@ -38,15 +38,33 @@ class AbstractCalendar(object):
     seconds = staticmethod(datetime_to_seconds)
 
     def get_offset(self, date, granularity):
-        offset_method = getattr(self, '_get_offset_%s' % granularity.replace('-', '_'))
-        return offset_method(date) + self.get_frac_offset(date, granularity)
+        return (self._method('offset', granularity)(date)
+                + self.get_frac_offset(date, granularity))
 
     def get_frac_offset(self, date, granularity):
-        frac_offset_method = getattr(self, '_get_frac_offset_%s' % granularity.replace('-', '_'))
-        return frac_offset_method(date)
+        return self._method('frac_offset', granularity)(date)
+
+    # vectorized method name: scalar method name
+    _vectorized = {'offsets': 'offset', 'frac_offsets': 'frac_offset'}
+
+    def _method(self, name, granularity):
+        """ return the `_get_<name>_<granularity>` method, resolved once per
+        calendar and granularity """
+        # created lazily, subclasses need not call __init__
+        methods = self.__dict__.setdefault('_methods', {})
+        try:
+            return methods[name, granularity]
+        except KeyError:
+            attr = '_get_%s_%s' % (name, granularity.replace('-', '_'))
+            if name in self._vectorized and not hasattr(self, attr):
+                method = self._scalar_loop(self._method(self._vectorized[name], granularity))
+            else:
+                method = getattr(self, attr)
+            methods[name, granularity] = method
+            return method
 
     def _get_offset_15min(self, date):
-        return (self.ordinal(date)*24+date.hour)*4 + self.seconds(date)//(15*60)
+        return (self.ordinal(date)*24+date.hour)*4 + (self.seconds(date) % 3600)//(15*60)
 
     def _get_offset_hourly(self, date):
         return self.ordinal(date)*24 + self.seconds(date)//3600 # XXX DST!
@@ -106,6 +124,48 @@ class AbstractCalendar(object):
     def _get_frac_offset_constant(self, date):
         return 0
 
+    # vectorized versions of the above, on datetime64 arrays (python
+    # datetimes are accepted too); unless a calendar defines
+    # `_get_offsets_<granularity>` and `_get_frac_offsets_<granularity>`
+    # methods, they call the scalar methods on each date
+
+    def get_offsets(self, dates, granularity):
+        """ vectorized version of `get_offset` """
+        dates = numpy.asarray(dates, dtype='datetime64[us]')
+        return (self._method('offsets', granularity)(dates)
+                + self.get_frac_offsets(dates, granularity))
+
+    def get_frac_offsets(self, dates, granularity):
+        """ vectorized version of `get_frac_offset` """
+        dates = numpy.asarray(dates, dtype='datetime64[us]')
+        return self._method('frac_offsets', granularity)(dates)
+
+    @staticmethod
+    def _scalar_loop(method):
+        """ return a vectorized version of the scalar `method` """
+        def vectorized(dates):
+            values = [method(date) for date in dates.ravel().tolist()]
+            return numpy.array(values, dtype=numpy.float64).reshape(dates.shape)
+        return vectorized
+
+    @staticmethod
+    def seconds_array(dates):
+        """ vectorized version of `seconds` """
+        return (dates.astype('datetime64[s]') - dates.astype('datetime64[D]')).astype(numpy.int64)
+
+    def _get_offsets_time_vector(self, dates):
+        return numpy.trunc(self.datetimes_to_timestamps(dates))
+
+    def _get_offsets_constant(self, dates):
+        return numpy.zeros(dates.shape, dtype=numpy.int64)
+
+    def _get_frac_offsets_time_vector(self, dates):
+        offsets = self.datetimes_to_timestamps(dates)
+        return offsets - numpy.floor(offsets)
+
+    def _get_frac_offsets_constant(self, dates):
+        return numpy.zeros(dates.shape)
+
     def get_duration_in_days(self, granularity, date):
         '''
         Compute the duration of the time interval associated to
@@ -121,6 +181,26 @@ class AbstractCalendar(object):
             date = self.prev_year_start(date)
             return days_in_year(date)
 
+    def get_period_start(self, date, granularity):
+        '''
+        return the start of the time interval of the given granularity
+        holding date
+        '''
+        if granularity == '15min':
+            return date.replace(minute=date.minute - date.minute % 15,
+                                second=0, microsecond=0)
+        elif granularity == 'hourly':
+            return date.replace(minute=0, second=0, microsecond=0)
+        elif granularity == 'daily':
+            return self.start_of_day(date)
+        elif granularity == 'weekly':
+            return self.start_of_day(date) - datetime.timedelta(days=self.day_of_week(date))
+        elif granularity == 'monthly':
+            return self.prev_month_start(date)
+        elif granularity == 'yearly':
+            return self.prev_year_start(date)
+        raise ValueError(granularity)
+
     def ordinal(self, date):
         """
         return the number of days since Jan 1st, 0001 (this one being having ordinal 0)
@@ -199,11 +279,86 @@ class AbstractCalendar(object):
         """return a datetime from a fraction of days since an epoch"""
         return epoch + datetime.timedelta(days=timestamp)
 
+    @staticmethod
+    def datetimes_to_timestamps(dates, epoch=ORIGIN):
+        """return an array of fractions of days since an epoch from an array
+        of dates (vectorized version of datetime_to_timestamp)"""
+        deltas = (numpy.asarray(dates, dtype='datetime64[us]')
+                  - numpy.datetime64(epoch, 'us'))
+        days, seconds = numpy.divmod(deltas // numpy.timedelta64(1, 's'), 3600*24)
+        return days + seconds / (3600*24)
+
+    @staticmethod
+    def timestamps_to_datetime64(timestamps, epoch=ORIGIN):
+        """return a datetime64 array from an array of fractions of days since
+        an epoch (vectorized version of timestamp_to_datetime)"""
+        usecs = numpy.round(numpy.asarray(timestamps, dtype=numpy.float64) * 86400e6)
+        return numpy.datetime64(epoch, 'us') + usecs.astype('timedelta64[us]')
+
 
 class GregorianCalendar(AbstractCalendar):
     def ordinal(self, date):
         return date.toordinal()
 
+    def ordinals(self, dates):
+        """
+        vectorized version of `ordinal` on a datetime64 array
+        """
+        # datetime64 use the proleptic gregorian calendar
+        days = dates.astype('datetime64[D]') - numpy.datetime64('0001-01-01', 'D')
+        return days.astype(numpy.int64) + 1
+
+    # numpy versions of the scalar offset methods, which ignore microseconds
+    # as well
+
+    def _get_offsets_15min(self, dates):
+        seconds = self.seconds_array(dates)
+        return (self.ordinals(dates)*24 + seconds//3600)*4 + (seconds % 3600)//(15*60)
+
+    def _get_offsets_hourly(self, dates):
+        return self.ordinals(dates)*24 + self.seconds_array(dates)//3600
+
+    def _get_offsets_daily(self, dates):
+        return self.ordinals(dates)
+
+    def _get_offsets_weekly(self, dates):
+        return (self.ordinals(dates) - 1)//7
+
+    def _get_offsets_monthly(self, dates):
+        # months since 1970-01
+        return dates.astype('datetime64[M]').astype(numpy.int64) + 1969*12
+
+    def _get_offsets_yearly(self, dates):
+        return dates.astype('datetime64[Y]').astype(numpy.int64) + 1969
+
+    def _get_frac_offsets_15min(self, dates):
+        return (self.seconds_array(dates) % (15*60)) / (15*60)
+
+    def _get_frac_offsets_hourly(self, dates):
+        return (self.seconds_array(dates) % 3600) / 3600
+
+    def _get_frac_offsets_daily(self, dates):
+        return self.seconds_array(dates) / (3600*24)
+
+    def _get_frac_offsets_weekly(self, dates):
+        ordinals = self.ordinals(dates) - 1
+        return (ordinals % 7) / 7 + self.seconds_array(dates)/(3600*24*7)
+
+    def _get_frac_offsets_monthly(self, dates):
+        months = dates.astype('datetime64[M]')
+        start_of_months = months.astype('datetime64[D]')
+        seconds = (dates.astype('datetime64[s]') - start_of_months).astype(numpy.int64)
+        days = ((months + 1).astype('datetime64[D]') - start_of_months).astype(numpy.int64)
+        return seconds / (days*3600*24)
+
+    def _get_frac_offsets_yearly(self, dates):
+        frac_ordinals = self.ordinals(dates) + self.seconds_array(dates) / (3600*24)
+        years = dates.astype('datetime64[Y]')
+        start_of_years = self.ordinals(years.astype('datetime64[us]'))
+        days = ((years + 1).astype('datetime64[D]') - years.astype('datetime64[D]')).astype(numpy.int64)
+        return (frac_ordinals - start_of_years) / days
+
+
     def day_of_week(self, date):
         return date.weekday()
     
@@ -24,7 +24,26 @@ function init_ts_grid(gridid, url) {
 // /Grid
 // Plot
 
-function init_ts_plot(figid, plotdata) {
+function fetch_ts_plot_data(urls, plotdata, from, to, points, callback) {
+  // fetch the points of each time series between the `from` and `to` ticks
+  // and call `callback` with the new plot data once all have arrived
+  var zoomdata = [];
+  var pending = urls.length;
+  jQuery.each(urls, function (i, url) {
+    zoomdata.push({label: plotdata[i].label, data: plotdata[i].data});
+    jQuery.getJSON(url, {start: from, end: to, points: points}, function (data) {
+      zoomdata[i].data = data;
+      pending -= 1;
+      if (!pending) {
+        callback(zoomdata);
+      }
+    });
+  });
+}
+
+function init_ts_plot(figid, plotdata, urls, points) {
+  // plotdata is a coarse version of the time series, finer points of the
+  // selected ranges are fetched from `urls` if given
   var mainfig = jQuery('#main' + figid);
   var overviewfig = jQuery('#overview' + figid);
 
@@ -45,22 +64,34 @@ function init_ts_plot(figid, plotdata) {
          };
     var main = jQuery.plot(mainfig, plotdata, mainoptions);
     var overview = jQuery.plot(overviewfig, plotdata, overviewoptions);
+    // the last selected range, to drop the answers to previous ones
+    var zoom = null;
     mainfig.bind("plothover", onTSPlotHover);
     // now connect the two
     mainfig.bind("plotselected", function (event, ranges) {
-        // do the zooming
-        main = jQuery.plot(mainfig, plotdata,
-                      jQuery.extend(true, {}, mainoptions, {
+        var zoomoptions = jQuery.extend(true, {}, mainoptions, {
                           xaxis: { min: ranges.xaxis.from, max: ranges.xaxis.to }
-                      }));
+                      });
+        // do the zooming
+        main = jQuery.plot(mainfig, plotdata, zoomoptions);
         // don't fire event on the overview to prevent eternal loop
         overview.setSelection(ranges, true);
+        zoom = ranges;
+        if (urls) {
+            fetch_ts_plot_data(urls, plotdata, ranges.xaxis.from, ranges.xaxis.to,
+                               points, function (zoomdata) {
+                if (zoom === ranges) {
+                    main = jQuery.plot(mainfig, zoomdata, zoomoptions);
+                }
+            });
+        }
     });
     overviewfig.bind('plotselected', function (event, ranges) {
         main.setSelection(ranges);
     });
     jQuery("#reset").click(function () {
-        jQuery.plot(mainfig, plotdata, mainoptions);
+        zoom = null;
+        main = jQuery.plot(mainfig, plotdata, mainoptions);
         overview.clearSelection();
     });
     mainfig.attr('cubicweb:type','prepared-plot');
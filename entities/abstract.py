@@ -1,23 +1,70 @@
-import zlib
-import pickle
 from logilab.common.decorators import cachedproperty
 
-class AbstractTSMixin(object):
+from cubes.timeseries import cache, storage
+
+class SharedArraysMixin(object):
+    """ decode array attributes through the shared cache of arrays """
+
+    def _decoder(self, attr):
+        return lambda: storage.decode_array(getattr(self, attr).getvalue())
+
+    def _shared_array(self, key, compute):
+        """ return the array computed by `compute` (e.g. decoding an
+        attribute), going through the shared cache of arrays (see `cache`)
+        once the entity is saved """
+        key = self._array_cache_key(key)
+        if key is None:
+            return compute()
+        array = cache.ARRAY_CACHE.get(key)
+        if array is None:
+            array = cache.ARRAY_CACHE.put(key, compute())
+        return array
+
+    def _array_cache_key(self, key):
+        if not self.cw_is_saved():
+            return None
+        return (self.eid, self.modification_date, key)
+
+
+class AbstractTSMixin(SharedArraysMixin):
 
     @cachedproperty
     #@cached(cacheattr='_array') XXX once lgc 0.56 is out
     def array(self):
-        raw_data = self.data.getvalue()
-        try:
-            raw_data = zlib.decompress(raw_data)
-        except zlib.error:
-            # assume uncompressed data
-            pass
-        return pickle.loads(raw_data)
+        return self._shared_array('data', self._decoder('data'))
+
+    def _array_loaded(self):
+        return ('array' in vars(self)
+                or self._array_cache_key('data') in cache.ARRAY_CACHE)
+
+    @cachedproperty
+    def _stored_array(self):
+        return storage.ChunkedArray(self.data.getvalue())
+
+    def read_array(self, index):
+        """ return self.array[index], only decoding the stored chunks
+        holding the requested values unless the whole array is already loaded
+        (or cached)
+        """
+        if self._array_loaded():
+            return self.array[index]
+        return self._stored_array[index]
+
+    @property
+    def count(self):
+        if self._array_loaded():
+            return self.array.size
+        return len(self._stored_array)
+
+    def clear_data_caches(self):
+        """ clear the caches derived from the stored values and the
+        attributes locating them, keeping the entity's attributes (e.g. when
+        they are being edited) """
+        if '_stored_array' in vars(self):
+            del self._stored_array
 
     def cw_clear_all_caches(self):
         if 'array' in vars(self):
             del self.array
+        self.clear_data_caches()
         super(AbstractTSMixin, self).cw_clear_all_caches()
-
-
@@ -5,22 +5,23 @@
 :contact: http://www.logilab.fr/ -- mailto:contact@logilab.fr
 :license: GNU Lesser General Public License, v2.1 - http://www.gnu.org/licenses
 """
-import tempfile
-import os
 import csv
-import zlib
+import mmap
 import datetime
-import pickle
 import os.path as osp
-from io import StringIO
+from io import BytesIO
+from itertools import islice
 
 import numpy
 
+from logilab.common.decorators import clear_cache
+
 from cubicweb import Binary, ValidationError, _
 from cubicweb.predicates import is_instance, ExpectedValuePredicate
 from cubicweb.view import EntityAdapter
 
-from cubes.timeseries.utils import get_formatter
+from cubes.timeseries import storage
+from cubes.timeseries.utils import get_formatter, excel_date_format
 from cubes.timeseries.entities import utils
 
 
@@ -31,12 +32,19 @@ class mimetype(ExpectedValuePredicate):
         return kwargs.get('mimetype')
 
 class filename_ext(ExpectedValuePredicate):
-    """ a selector for converters  """
+    """ a selector for converters
+
+    Compressed files (see `utils.DECOMPRESSORS`) have a compound extension,
+    such as '.txt.gz'.
+    """
 
     def _get_value(self, cls, req, **kwargs):
         fname = kwargs.get('filename')
         if fname:
-            return osp.splitext(fname)[1]
+            base, ext = osp.splitext(fname)
+            if ext in utils.DECOMPRESSORS:
+                ext = osp.splitext(base)[1] + ext
+            return ext
         return fname
 
 
@@ -66,14 +74,17 @@ class TSImportAdapter(EntityAdapter):
     __select__ = is_instance('TimeSeries')
 
     def grok_data(self):
-        """ self.data is something such as an excel file or CSV data or a pickled
+        """ self.data is something such as an excel file or CSV data or a
         numpy array or an already processed binary.
 
-        Ensure it's a pickle numpy array before storing object in db.
+        Ensure it's an encoded numpy array (see `storage`) before storing
+        object in db.
 
         If data seems to be already processed, return True, else return False.
         """
         entity = self.entity
+        # the former values may have been read already
+        entity.clear_data_caches()
         try:
             filename = entity.data.filename.lower()
         except AttributeError:
@@ -84,12 +95,17 @@ class TSImportAdapter(EntityAdapter):
             #     raise TypeError('data is neither a Binary nor a numpy array (%s)' % type(data))
             numpy_array = data
         else:
-            adapter = self._cw.vreg['adapters'].select_or_none('source_to_numpy_array',
-                                                               self._cw, entity=entity, filename=filename)
-            if adapter is None:
-                msg = self._cw._('Unsupported file type %s') % entity.data.filename
-                raise ValidationError(entity.eid, {'data': msg})
-            numpy_array = adapter.to_numpy_array(entity.data, filename)
+            try:
+                adapter = self._cw.vreg['adapters'].select_or_none('source_to_numpy_array',
+                                                                   self._cw, entity=entity, filename=filename)
+                if adapter is None:
+                    msg = self._cw._('Unsupported file type %s') % entity.data.filename
+                    raise ValidationError(entity.eid, {'data': msg})
+                numpy_array = adapter.to_numpy_array(entity.data, filename)
+            finally:
+                if isinstance(entity.data, utils.UploadedFile):
+                    # remove the spooled file
+                    entity.data.close()
 
         if numpy_array.ndim != 1:
             raise ValidationError(entity.eid,
@@ -97,13 +113,52 @@ class TSImportAdapter(EntityAdapter):
         if numpy_array.size == 0:
             raise ValidationError(entity.eid,
                                   {'data': _('data must have at least one value')})
-        data = Binary()
-        compressed_data = zlib.compress(pickle.dumps(numpy_array, protocol=2))
-        data.write(compressed_data)
+        data = Binary(self.encode_data(numpy_array))
         entity.cw_edited['data'] = data
         entity.array = numpy_array
         return False
 
+    def recode(self):
+        """ store again already processed data, using the current codec """
+        entity = self.entity
+        entity.cw_edited['data'] = Binary(self.encode_data(entity.array))
+
+    def update_rollups(self, granularities):
+        """ replace the rollup tiers of the entity by tiers of the given
+        granularities (see `TimeSeries.compute_rollups`) """
+        entity = self.entity
+        # dates may have been computed before the granularity or start date
+        # were edited
+        entity.clear_data_caches()
+        self._cw.execute('DELETE TimeSeriesRollup R WHERE R rollup_of X, X eid %(x)s',
+                         {'x': entity.eid})
+        for attrs in entity.compute_rollups(granularities):
+            for attr in ('min_values', 'max_values', 'sum_values', 'counts'):
+                attrs[attr] = Binary(storage.encode_array(attrs[attr], codec=self.codec))
+            self._cw.create_entity('TimeSeriesRollup', rollup_of=entity, **attrs)
+        clear_cache(entity, 'rollups')
+
+    def encode_data(self, array):
+        """ return the bytes to be stored for the data array """
+        return storage.encode_array(array, codec=self.codec)
+
+    @property
+    def codec(self):
+        """ compression codec of the entity, else the instance's default one
+        """
+        entity = self.entity
+        # cw_edited is only set on entities being edited
+        if 'codec' in getattr(entity, 'cw_edited', ()):
+            codec = entity.cw_edited['codec']
+        elif entity.cw_is_saved():
+            codec = entity.codec
+        else:
+            codec = None
+        if codec is None:
+            codec = self._cw.vreg.config.get('timeseries-codec',
+                                             storage.DEFAULT_CODEC)
+        return storage.available_codec(codec)
+
 class NPTSImportAdapter(TSImportAdapter):
     __select__ = is_instance('NonPeriodicTimeSeries')
 
@@ -114,21 +169,37 @@ class NPTSImportAdapter(TSImportAdapter):
         if super(NPTSImportAdapter, self).grok_data():
             return # already processed
         numpy_array = self.grok_timestamps()
-        tstamp_data = Binary()
-        compressed_data = zlib.compress(pickle.dumps(numpy_array, protocol=2))
-        tstamp_data.write(compressed_data)
+        tstamp_data = Binary(self.encode_timestamps(numpy_array))
         self.entity.cw_edited['timestamps'] = tstamp_data
         self.entity.timestamps_array = numpy_array
 
+    def recode(self):
+        super(NPTSImportAdapter, self).recode()
+        entity = self.entity
+        entity.cw_edited['timestamps'] = Binary(self.encode_timestamps(
+            entity.timestamps_array))
+
+    def encode_data(self, array):
+        """ float values are xor-ed with the previous ones before compression
+        when it pays off (see `storage.choose_filter`) """
+        codec = self.codec
+        filter = storage.choose_filter(array, (None, 'xor'), codec)
+        return storage.encode_array(array, codec=codec, filter=filter)
+
+    def encode_timestamps(self, array):
+        """ timestamps are nearly regular, store their delta of delta """
+        return storage.encode_array(array, codec=self.codec, filter='dod')
+
     def grok_timestamps(self):
         timestamps = self.entity.timestamps
         if len(timestamps) != self.entity.count:
             raise ValueError('data/timestamps vectors size mismatch')
-        if isinstance(timestamps[0], (datetime.datetime, datetime.date)):
-            timestamps = [self.entity.calendar.datetime_to_timestamp(v)
-                          for v in timestamps]
+        timestamps = numpy.asarray(timestamps)
+        if (timestamps.dtype.kind == 'M'
+            or isinstance(timestamps[0], (datetime.datetime, datetime.date))):
+            timestamps = self.entity.calendar.datetimes_to_timestamps(timestamps)
         else:
-            assert isinstance(timestamps[0], (int, float))
+            assert timestamps.dtype.kind in 'iuf'
         tstamp_array = numpy.array(timestamps, dtype=numpy.float64)
         if not (tstamp_array[:-1] < tstamp_array[1:]).all():
             raise ValueError('time stamps must be a strictly ascendant vector')
@@ -139,24 +210,44 @@ class NPTSImportAdapter(TSImportAdapter):
 
 class TSTXTToNumpyArray(EntityAdapter):
     __regid__ = 'source_to_numpy_array'
-    __select__ = is_instance('TimeSeries') & filename_ext('.txt')
+    __select__ = is_instance('TimeSeries') & filename_ext(
+        '.txt', *['.txt' + ext for ext in utils.DECOMPRESSORS])
 
 
     def to_numpy_array(self, file, filename):
-        try:
-            return numpy.array([float(x.strip().split()[-1]) for x in file],
-                               dtype=self.entity.dtype)
-        except ValueError:
-            raise ValueError('invalid data in %s (expecting one number per line '
-                             '(with optionally a date in the first column), '
-                             'with . as the decimal separator)' % filename)
+        compression = osp.splitext(filename)[1]
+        if compression not in utils.DECOMPRESSORS:
+            compression = None
+        blocks = []
+        lineno = 1
+        for block in utils.iter_line_blocks(utils.iter_chunks(file, compression)):
+            fields, lines = utils.last_fields(block)
+            try:
+                values = utils.fields_to_floats(fields)
+            except utils.FloatParseError as exc:
+                raise ValueError('invalid data on line %s of %s (expecting one number '
+                                 'per line (with optionally a date in the first column), '
+                                 'with . as the decimal separator)'
+                                 % (lineno + lines[exc.index], filename))
+            blocks.append(values.astype(self.entity.dtype, copy=False))
+            lineno += block.count(b'\n')
+        if not blocks:
+            return numpy.array([], dtype=self.entity.dtype)
+        return numpy.concatenate(blocks)
 
 
 class CSVImportMixin(object):
+    # size of the file prefix used to guess the csv dialect
+    sniff_size = 64 * 1024
+    # number of rows converted at once
+    block_size = 64 * 1024
 
     def snif_csv_dialect(self, file):
         sniffer = csv.Sniffer()
-        raw_data = file.read()
+        raw_data = file.read(self.sniff_size)
+        if len(raw_data) == self.sniff_size:
+            # don't let a truncated last line fool the sniffer
+            raw_data = raw_data[:raw_data.rfind('\n') + 1] or raw_data
         try:
             dialect = sniffer.sniff(raw_data, sniffer.preferred)
             has_header = sniffer.has_header(raw_data)
@@ -167,6 +258,52 @@ class CSVImportMixin(object):
         file.seek(0)
         return dialect, has_header
 
+    def csv_blocks(self, file, filename, dialect, has_header):
+        """ yield (line number, rows) for each block of at most `block_size`
+        rows of the csv file, line number being the one of the first row
+
+        When no header was detected, a first line whose last column is not a
+        number is still considered as a header and skipped.
+        """
+        reader = csv.reader(file, dialect)
+        lineno = 1
+        if has_header:
+            next(reader, None)
+            lineno += 1
+        while True:
+            rows = list(islice(reader, self.block_size))
+            if not rows:
+                return
+            if lineno == 1 and rows[0]:
+                try:
+                    self.parse_values([rows[0][-1]])
+                except ValueError:
+                    self.debug('error while parsing first line of %s', filename)
+                    rows = rows[1:]
+                    lineno += 1
+            yield lineno, rows
+            lineno += len(rows)
+
+    def parse_values(self, strings, lineno=None, filename=None):
+        """ return a float array of the numbers in `strings`, written using the
+        user's decimal and thousands separators """
+        prefs = self._cw.user.format_preferences[0]
+        try:
+            return utils.parse_floats(strings, prefs.decimal_separator,
+                                      prefs.thousands_separator or '')
+        except utils.FloatParseError as exc:
+            if lineno is None:
+                raise
+            raise ValueError('Invalid data type for value %s on line %s of %s' %
+                             (exc.string, lineno + exc.index, filename))
+
+    def values_array(self, blocks):
+        """ return the concatenation of the parsed blocks of values, with the
+        entity's data type """
+        if not blocks:
+            return numpy.array([], dtype=self.entity.dtype)
+        return numpy.concatenate(blocks).astype(self.entity.dtype, copy=False)
+
 
 class TSCSVToNumpyArray(CSVImportMixin, EntityAdapter):
     __regid__ = 'source_to_numpy_array'
@@ -178,29 +315,14 @@ class TSCSVToNumpyArray(CSVImportMixin, EntityAdapter):
             dialect, has_header = self.snif_csv_dialect(file)
         else:
             assert dialect in csv.list_dialects()
-        reader = csv.reader(file, dialect)
-        if has_header:
-            reader.next()
-        series = []
         # TODO: check granularity if we have a date column
-        prefs = self._cw.user.format_preferences[0]
-        dec_sep = prefs.decimal_separator
-        th_sep = prefs.thousands_separator or ''
-        for line, values in enumerate(reader):
-            if len(values) not in (1, 2):
+        blocks = []
+        for lineno, rows in self.csv_blocks(file, filename, dialect, has_header):
+            if not set(map(len, rows)) <= set((1, 2)):
                 raise ValueError('Too many columns in %s' % filename)
-            try:
-                strval = values[-1].replace(th_sep, '').replace(dec_sep, '.')
-                val = float(strval)
-            except ValueError:
-                if line == 0 and not has_header:
-                    self.debug('error while parsing first line of %s', filename)
-                    continue # assume there was a header
-                else:
-                    raise ValueError('Invalid data type for value %s on line %s of %s' %
-                                     (values[-1], reader.line_num, filename))
-            series.append(val)
-        return numpy.array(series, dtype=self.entity.dtype)
+            blocks.append(self.parse_values([row[-1] for row in rows],
+                                            lineno, filename))
+        return self.values_array(blocks)
 
 
 class TSXLSToNumpyArray(EntityAdapter):
@@ -208,9 +330,17 @@ class TSXLSToNumpyArray(EntityAdapter):
     __select__ = is_instance('TimeSeries') & filename_ext('.xls')
 
     def to_numpy_array(self, file, filename):
-        xl_data = file.read()
-        wb = utils.xlrd.open_workbook(filename=file.filename,
-                                      file_contents=xl_data)
+        try:
+            # map files on disk rather than reading them in memory
+            xl_data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, ValueError, EnvironmentError):
+            xl_data = file.read()
+        try:
+            wb = utils.xlrd.open_workbook(filename=file.filename,
+                                          file_contents=xl_data)
+        finally:
+            if isinstance(xl_data, mmap.mmap):
+                xl_data.close()
         sheet = wb.sheet_by_index(0)
         values = []
         col = sheet.ncols - 1
@@ -236,7 +366,8 @@ class TSXLSXToNumpyArray(EntityAdapter):
         sheet = wb.worksheets[0]
         values = []
         for rownum, row in enumerate(rows(sheet)):
-            cell_value = value(row[0])
+            # values are in the last column, dates may precede them
+            cell_value = value(row[-1])
             try:
                 cell_value = float(cell_value)
             except ValueError:
@@ -248,6 +379,106 @@ class TSXLSXToNumpyArray(EntityAdapter):
         return numpy.array(values, dtype=self.entity.dtype)
 
 
+class TSNPYToNumpyArray(EntityAdapter):
+    """ a .npy file holds no time stamps, non periodic time series are
+    imported from .npz files """
+    __regid__ = 'source_to_numpy_array'
+    __select__ = is_instance('TimeSeries') & filename_ext('.npy')
+
+    def to_numpy_array(self, file, filename):
+        try:
+            array = utils.load_npy(file)
+        except ValueError as exc:
+            raise ValueError('Unable to read a Timeseries in %s (%s)' % (filename, exc))
+        return numpy.asarray(array, dtype=self.entity.dtype)
+
+
+class TSNPZToNumpyArray(EntityAdapter):
+    __regid__ = 'source_to_numpy_array'
+    __select__ = is_instance('TimeSeries') & filename_ext('.npz')
+
+    def to_numpy_array(self, file, filename):
+        try:
+            npz = numpy.load(file, allow_pickle=False)
+        except (ValueError, IOError) as exc:
+            raise ValueError('Unable to read a Timeseries in %s (%s)' % (filename, exc))
+        try:
+            return numpy.asarray(self.read_arrays(npz, filename), dtype=self.entity.dtype)
+        finally:
+            npz.close()
+
+    def read_arrays(self, npz, filename):
+        """ return the data array of the `npz` file, named 'data' unless it
+        is the only one """
+        if 'data' in npz.files:
+            return npz['data']
+        if len(npz.files) == 1:
+            return npz[npz.files[0]]
+        raise ValueError('Expecting a "data" array in %s, found %s'
+                         % (filename, ', '.join(npz.files)))
+
+
+class NPTSNPZToNumpyArray(TSNPZToNumpyArray):
+    """ .npz files of non periodic time series hold a 'timestamps' array
+    (datetime64 or fractions of days as in `TimeSeries.calendar`) along the
+    'data' array """
+    __select__ = is_instance('NonPeriodicTimeSeries') & filename_ext('.npz')
+
+    def read_arrays(self, npz, filename):
+        if not set(('timestamps', 'data')) <= set(npz.files):
+            raise ValueError('Expecting "timestamps" and "data" arrays in %s, found %s'
+                             % (filename, ', '.join(npz.files)))
+        self.entity.cw_attr_cache['timestamps'] = npz['timestamps']
+        return npz['data']
+
+
+class ArrowImportMixin(object):
+    """ read tables of a 'timestamp' and a 'value' column, as written by
+    `ArrowExportMixin` (else the first and last columns) """
+
+    def read_table(self, file):
+        raise NotImplementedError
+
+    def to_numpy_array(self, file, filename):
+        try:
+            table = self.read_table(file)
+        except (utils.pyarrow.ArrowException, EnvironmentError) as exc:
+            raise ValueError('Unable to read a Timeseries in %s (%s)' % (filename, exc))
+        if not table.num_columns:
+            raise ValueError('Unable to read a Timeseries in %s' % filename)
+        names = table.schema.names
+        entity = self.entity
+        if entity.cw_etype == 'NonPeriodicTimeSeries':
+            if table.num_columns < 2:
+                raise ValueError('Expecting timestamp and value columns in %s' % filename)
+            tcolumn = table.column(names.index('timestamp') if 'timestamp' in names else 0)
+            entity.cw_attr_cache['timestamps'] = tcolumn.to_numpy()
+        # new time series take the unit of the exported one unless given
+        unit = (table.schema.metadata or {}).get(b'unit')
+        if unit and not entity.cw_is_saved() and not entity.cw_edited.get('unit'):
+            entity.cw_edited['unit'] = unit.decode('utf-8')
+        vcolumn = table.column(names.index('value') if 'value' in names else -1)
+        return numpy.asarray(vcolumn.to_numpy(), dtype=entity.dtype)
+
+
+class TSArrowToNumpyArray(ArrowImportMixin, EntityAdapter):
+    __regid__ = 'source_to_numpy_array'
+    __select__ = (is_instance('TimeSeries', 'NonPeriodicTimeSeries')
+                  & filename_ext('.arrow', '.feather'))
+
+    def read_table(self, file):
+        return utils.pyarrow.ipc.open_file(file).read_all()
+
+
+class TSParquetToNumpyArray(ArrowImportMixin, EntityAdapter):
+    __regid__ = 'source_to_numpy_array'
+    __select__ = (is_instance('TimeSeries', 'NonPeriodicTimeSeries')
+                  & filename_ext('.parquet'))
+
+    def read_table(self, file):
+        return utils.pyarrow.parquet.read_table(file)
+
+
 class NDTSCSVToNumpyArray(CSVImportMixin, EntityAdapter):
     __regid__ = 'source_to_numpy_array'
     __select__ = is_instance('NonPeriodicTimeSeries') & (filename_ext('.csv') | filename_ext('.txt'))
@@ -257,38 +488,47 @@ class NDTSCSVToNumpyArray(CSVImportMixin, EntityAdapter):
             dialect, has_header = self.snif_csv_dialect(file)
         else:
             assert dialect in csv.list_dialects()
-        reader = csv.reader(file, dialect)
-        if has_header:
-            next(reader)
-        series = []
+        blocks = []
         tstamps = []
+        format = None
         # TODO: check granularity if we have a date column
-        prefs = self._cw.user.format_preferences[0]
-        dec_sep = prefs.decimal_separator
-        th_sep = prefs.thousands_separator or ''
-        cal = self.entity.calendar
-        for line, values in enumerate(reader):
-            if len(values) != 2:
-                raise ValueError('Expecting exactly 2 columns (timestamp, value), found %s in %s' % (len(values), filename))
-            try:
-                strval = values[1].replace(th_sep, '').replace(dec_sep, '.')
-                val = float(strval)
-            except ValueError:
-                if line == 0 and not has_header:
-                    self.debug('error while parsing first line of %s', filename)
-                    continue # assume there was a header
-                else:
-                    raise ValueError('Invalid data type for value %s on line %s of %s' %
-                                     (values[-1], reader.line_num, filename))
+        for lineno, rows in self.csv_blocks(file, filename, dialect, has_header):
+            for values in rows:
+                if len(values) != 2:
+                    raise ValueError('Expecting exactly 2 columns (timestamp, value), found %s in %s' % (len(values), filename))
+            blocks.append(self.parse_values([row[1] for row in rows],
+                                            lineno, filename))
+            strings = [row[0] for row in rows]
+            if format is None:
+                format = self.guess_datetime_format(strings[0])
+            tstamps.append(self.parse_datetimes(strings, format))
+        # converted to time stamps by NPTSImportAdapter.grok_timestamps
+        if tstamps:
+            tstamps = numpy.concatenate(tstamps)
+        self.entity.cw_attr_cache['timestamps'] = numpy.asarray(tstamps, dtype='datetime64[us]')
+        return self.values_array(blocks)
+
+    def guess_datetime_format(self, sample):
+        """ return the user's datetime or date format if `sample` matches it,
+        else None """
+        formats = (self._cw.property_value('ui.datetime-format'),
+                   self._cw.property_value('ui.date-format'))
+        try:
+            return utils.guess_datetime_format(sample, formats)
+        except ValueError:
+            return None
+
+    def parse_datetimes(self, strings, format):
+        """ return a datetime64 array of the dates in `strings`, all parsed
+        with `format` when possible """
+        if format is not None:
             try:
-                tstamp_datetime = self._cw.parse_datetime(values[0])
-                tstamp = cal.datetime_to_timestamp(tstamp_datetime)
+                return utils.parse_datetimes(strings, format)
             except ValueError:
-                raise
-            series.append(val)
-            tstamps.append(tstamp)
-        self.entity.cw_attr_cache['timestamps'] = numpy.array(tstamps)
-        return numpy.array(series, dtype=self.entity.dtype)
+                pass
+        # mixed formats or invalid dates, let parse_datetime sort them out
+        return numpy.array([self._cw.parse_datetime(string) for string in strings],
+                           dtype='datetime64[us]')
 
 
 # exporters ####################################################################
@@ -301,6 +541,11 @@ class TimeSeriesExportAdapter(EntityAdapter):
     def export(self):
         raise NotImplementedError
 
+    def export_blocks(self):
+        """ yield the exported bytes by blocks, which may be sent as soon as
+        produced """
+        yield self.export()
+
     @property
     def filename(self):
         raise NotImplementedError
@@ -309,41 +554,79 @@ class TimeSeriesExportAdapter(EntityAdapter):
 class TimeSeriesCSVexport(TimeSeriesExportAdapter):
     """ export timestamped array to paste-into-excel-friendly csv """
     __select__ = TimeSeriesExportAdapter.__select__ & mimetype('text/csv')
+    # number of rows formatted at once
+    block_size = 64 * 1024
 
     def export(self):
+        return b''.join(self.export_blocks())
+
+    def export_blocks(self):
         entity = self.entity
         prefs = self._cw.user.format_preferences[0]
         dec_sep = prefs.decimal_separator
-        out = StringIO()
         dateformat, _numformat, _numformatter = get_formatter(self._cw, entity)
-        writer = csv.writer(out, dialect='excel', delimiter='\t')
-        for date, value in entity.timestamped_array():
-            outvalue = str(entity.output_value(value)).replace('.', dec_sep)
-            writer.writerow([date.strftime(dateformat), outvalue])
-        return out.getvalue()
+        dates = entity.date_index()
+        values = entity._output_array(entity.array)
+        for start in range(0, len(values), self.block_size):
+            stop = start + self.block_size
+            strdates = utils.format_datetimes(dates[start:stop], dateformat)
+            strvalues = utils.format_numbers(values[start:stop], dec_sep)
+            # tab separated excel dialect, none of the fields needs quoting
+            rows = '\r\n'.join(map('\t'.join, zip(strdates, strvalues)))
+            yield (rows + '\r\n').encode('utf-8')
 
     @property
     def filename(self):
         return 'ts.csv'
 
 
+class TimeSeriesNPYExport(TimeSeriesExportAdapter):
+    """ export the array in numpy's .npy format """
+    __select__ = is_instance('TimeSeries') & mimetype('application/x-npy')
+
+    def export(self):
+        out = BytesIO()
+        numpy.save(out, self.entity.array, allow_pickle=False)
+        return out.getvalue()
+
+    @property
+    def filename(self):
+        return 'ts.npy'
+
+
+class NPTSNPZExport(TimeSeriesExportAdapter):
+    """ export the time stamps and data arrays of non periodic time series
+    in numpy's .npz format, see `NPTSNPZToNumpyArray` """
+    __select__ = is_instance('NonPeriodicTimeSeries') & mimetype('application/x-npy')
+
+    def export(self):
+        entity = self.entity
+        out = BytesIO()
+        numpy.savez(out, timestamps=entity.timestamps_array, data=entity.array)
+        return out.getvalue()
+
+    @property
+    def filename(self):
+        return 'ts.npz'
+
+
 class TimeSeriesXLSExport(TimeSeriesExportAdapter):
     __select__ = TimeSeriesExportAdapter.__select__ & mimetype('application/vnd.ms-excel')
 
     def export(self):
-        # XXX timestamps ?
         entity = self.entity
         workbook = utils.xlwt.Workbook()
         sheet = workbook.add_sheet(('TS_%s' % entity.dc_title())[:31])
-        outrows = []
-        class Writer(object):
-            def write(self, data):
-                """ callback to comply to workbook.save api """
-                outrows.append(data)
-        for rownum, val in enumerate(entity.array):
-            sheet.write(rownum, 0, entity.output_value(val))
-        workbook.save(Writer())
-        return ''.join(outrows)
+        dateformat, _numformat, _numformatter = get_formatter(self._cw, entity)
+        datestyle = utils.xlwt.easyxf(num_format_str=excel_date_format(dateformat))
+        dates = entity.date_index().tolist()
+        values = entity.output_values(entity.array)
+        for rownum, (date, val) in enumerate(zip(dates, values)):
+            sheet.write(rownum, 0, date, datestyle)
+            sheet.write(rownum, 1, val)
+        out = BytesIO()
+        workbook.save(out)
+        return out.getvalue()
 
     @property
     def filename(self):
@@ -359,31 +642,81 @@ class TimeSeriesXLSXExport(TimeSeriesExportAdapter):
         workbook = utils.openpyxl.workbook.Workbook(write_only=True)
         sheet = workbook.create_sheet()
         sheet.title = ('TS_%s' % entity.dc_title())[:31]
-        for val in entity.array:
-            sheet.append([entity.output_value(val)])
-        try:
-            # XXX investigate why save_virtual_workbook
-            #     does not work
-            fd, fname = tempfile.mkstemp()
-            # let's windows not complain about a locked file
-            os.close(fd)
-            workbook.save(fname)
-            with open(fname, 'rb') as xlsx:
-                return xlsx.read()
-        finally:
-            try:
-                os.unlink(fname)
-            except:
-                pass
+        dateformat, _numformat, _numformatter = get_formatter(self._cw, entity)
+        dateformat = excel_date_format(dateformat)
+        # one cast of the whole arrays to python values
+        dates = entity.date_index().tolist()
+        values = entity.output_values(entity.array)
+        for date, value in zip(dates, values):
+            datecell = utils.openpyxl.cell.WriteOnlyCell(sheet, value=date)
+            datecell.number_format = dateformat
+            sheet.append((datecell, value))
+        out = BytesIO()
+        workbook.save(out)
+        return out.getvalue()
 
     @property
     def filename(self):
         return 'ts.xlsx'
 
 
+class ArrowExportMixin(object):
+    """ export the dates and values as 'timestamp' and 'value' columns,
+    with the unit, granularity and data type as schema metadata """
+
+    def table(self):
+        entity = self.entity
+        pyarrow = utils.pyarrow
+        metadata = {'granularity': entity.granularity or '',
+                    'unit': entity.unit or '',
+                    'data_type': entity.data_type}
+        # numeric arrays are wrapped without copy, booleans are bit packed
+        columns = [pyarrow.array(entity.date_index()),
+                   pyarrow.array(numpy.asarray(entity.array, dtype=entity.dtype))]
+        schema = pyarrow.schema([('timestamp', columns[0].type),
+                                 ('value', columns[1].type)],
+                                metadata=dict((key, value.encode('utf-8'))
+                                              for key, value in metadata.items()))
+        return pyarrow.Table.from_arrays(columns, schema=schema)
+
+
+class TimeSeriesArrowExport(ArrowExportMixin, TimeSeriesExportAdapter):
+    """ export to an Arrow IPC file """
+    __select__ = (TimeSeriesExportAdapter.__select__
+                  & mimetype('application/vnd.apache.arrow.file'))
+
+    def export(self):
+        table = self.table()
+        sink = utils.pyarrow.BufferOutputStream()
+        writer = utils.pyarrow.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+        return sink.getvalue().to_pybytes()
+
+    @property
+    def filename(self):
+        return 'ts.arrow'
+
+
+class TimeSeriesParquetExport(ArrowExportMixin, TimeSeriesExportAdapter):
+    __select__ = (TimeSeriesExportAdapter.__select__
+                  & mimetype('application/vnd.apache.parquet'))
+
+    def export(self):
+        sink = utils.pyarrow.BufferOutputStream()
+        utils.pyarrow.parquet.write_table(self.table(), sink)
+        return sink.getvalue().to_pybytes()
+
+    @property
+    def filename(self):
+        return 'ts.parquet'
+
+
 def registration_callback(vreg):
     always = [TSImportAdapter, NPTSImportAdapter, TSTXTToNumpyArray,
-              TSCSVToNumpyArray, NDTSCSVToNumpyArray, TimeSeriesCSVexport]
+              TSCSVToNumpyArray, NDTSCSVToNumpyArray, TSNPYToNumpyArray,
+              TSNPZToNumpyArray, NPTSNPZToNumpyArray, TimeSeriesCSVexport,
+              TimeSeriesNPYExport, NPTSNPZExport]
     for adapter in always:
         vreg.register(adapter)
     if utils.HANDLE_XLS:
@@ -392,3 +725,9 @@ def registration_callback(vreg):
     if utils.HANDLE_XLSX:
         vreg.register(TSXLSXToNumpyArray)
         vreg.register(TimeSeriesXLSXExport)
+    if utils.HANDLE_ARROW:
+        vreg.register(TSArrowToNumpyArray)
+        vreg.register(TimeSeriesArrowExport)
+    if utils.HANDLE_PARQUET:
+        vreg.register(TSParquetToNumpyArray)
+        vreg.register(TimeSeriesParquetExport)
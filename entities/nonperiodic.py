@@ -7,13 +7,9 @@
 """
 from __future__ import division
 
-import pickle
-import zlib
+import numpy
 
-from bisect import bisect_left
-from six.moves import zip as izip
-
-from logilab.common.decorators import cachedproperty, cached, clear_cache
+from logilab.common.decorators import cachedproperty, cached
 
 from cubicweb import _
 from cubicweb.entities import fetch_config
@@ -24,91 +20,151 @@ from cubes.timeseries.calendars import timedelta_to_days, timedelta_to_seconds
 
 class NonPeriodicTimeSeries(timeseries.TimeSeries):
     __regid__ = 'NonPeriodicTimeSeries'
-    fetch_attrs, cw_fetch_order = fetch_config(['data_type', 'unit', 'granularity'])
+    fetch_attrs, cw_fetch_order = fetch_config(['data_type', 'unit', 'granularity',
+                                                'modification_date'])
 
     is_constant = False
 
     @cachedproperty
     def timestamps_array(self):
         # XXX turn into datetime here ?
-        raw_data = self.timestamps.getvalue()
-        raw_data = zlib.decompress(raw_data)
-        return pickle.loads(raw_data)
+        return self._shared_array('timestamps', self._decoder('timestamps'))
 
     @cached
-    def timestamped_array(self):
-        data = []
-        for t, v in izip(self.timestamps_array, self.array):
-            data.append((self.calendar.timestamp_to_datetime(t), self.output_value(v)))
-        return data
+    def date_index(self):
+        return self.calendar.timestamps_to_datetime64(self.timestamps_array)
 
     @cachedproperty
     def start_date(self):
         return self.calendar.timestamp_to_datetime(self.timestamps_array[0])
 
+    @cachedproperty
+    def end_date(self):
+        return self.calendar.timestamp_to_datetime(self.timestamps_array[-1])
+
+    def _dates_at(self, indexes):
+        """ return self.date_index()[indexes], only converting the requested
+        time stamps """
+        return self.calendar.timestamps_to_datetime64(self.timestamps_array[indexes])
+
     def get_next_date(self, date):
-        index = bisect_left(self.timestamps_array, self.calendar.datetime_to_timestamp(date))
+        index = self.get_offset(date)
         # XXX what if out of bound
         return self.calendar.timestamp_to_datetime(self.timestamps_array[index])
 
     def get_rel_index(self, date, offset=-1):
         timestamp = self.calendar.datetime_to_timestamp(date)
         array = self.timestamps_array
-        idx = bisect_left(array, timestamp)
+        idx = int(array.searchsorted(timestamp))
         # unless this is an exact match, add offset if any to mimick periodic ts
         # behaviour
         if timestamp != array[idx]:
             return max(idx + offset, 0)
         return idx
 
-    def get_by_date(self, date, with_dates=False):
-        #pylint:disable-msg=E1101
-        if type(date) is slice:
-            assert date.step is None
-            if date.start is None:
-                start = None
-            else:
-                start = self.get_rel_index(date.start, -1)
-            if date.stop is None:
-                stop = None
-            else:
-                stop = self.get_rel_index(date.stop, 0)
-            index = slice(start, stop, None)
+    def get_rel_indexes(self, dates, offset=-1):
+        """ vectorized version of `get_rel_index` """
+        timestamps = self.calendar.datetimes_to_timestamps(dates)
+        array = self.timestamps_array
+        indexes = numpy.searchsorted(array, timestamps)
+        if len(indexes) and indexes.max() == len(array):
+            raise IndexError('some dates are after the last time stamp')
+        exact = array[indexes] == timestamps
+        return numpy.where(exact, indexes, numpy.maximum(indexes + offset, 0))
+
+    def _rel_slices(self, starts, ends):
+        return self.get_rel_indexes(starts, -1), self.get_rel_indexes(ends, 0)
+
+    def _rel_indexes(self, dates):
+        return self.get_rel_indexes(dates)
+
+    def get_rel_slice(self, date_slice):
+        assert date_slice.step is None
+        if date_slice.start is None:
+            start = None
         else:
-            index = self.get_rel_index(date)
-        return self.get_relative(index, with_dates)
+            start = self.get_rel_index(date_slice.start, -1)
+        if date_slice.stop is None:
+            stop = None
+        else:
+            stop = self.get_rel_index(date_slice.stop, 0)
+        return slice(start, stop, None)
+
+    def _first_index_from(self, date):
+        timestamp = self.calendar.datetime_to_timestamp(date)
+        return int(numpy.searchsorted(self.timestamps_array, timestamp))
+
+    def _date_slice(self, index):
+        return self._dates_at(index)
+
+    def _resample_bounds(self, granularity):
+        bounds = super(NonPeriodicTimeSeries, self)._resample_bounds(granularity)
+        # no value before the first time stamp, whose fractional offset would
+        # be negative
+        bounds[0, 0] = max(bounds[0, 0], numpy.datetime64(self.start_date, 'us'))
+        return bounds
+
+    @cached
+    def rollups(self):
+        # no rollup tiers for non periodic time series
+        return []
 
     def get_duration_in_days(self, date):
         idx = self.get_rel_index(date)
-        array = self.timestamped_array()
-        return timedelta_to_days(array[idx+1][0] - array[idx][0])
+        dates = self._dates_at([idx, idx + 1])
+        return timedelta_to_days((dates[1] - dates[0]).tolist())
+
+    def _durations_in_days(self, index=slice(None)):
+        first, stop, _step = index.indices(self.count)
+        dates = self.date_index()
+        if len(dates) < 2:
+            raise IndexError('a single time stamp has no duration')
+        durations = numpy.diff(dates[first:stop + 1]) / numpy.timedelta64(1, 'D')
+        if stop == len(dates):
+            # the last period is supposed as long as the previous one, as in
+            # get_frac_offset
+            last = (dates[-1] - dates[-2]) / numpy.timedelta64(1, 'D')
+            durations = numpy.append(durations, last)
+        return durations
 
     def get_frac_offset(self, date):
         idx = self.get_rel_index(date)
-        array = self.timestamped_array()
-        try:
-            totalsecs = timedelta_to_seconds(array[idx+1][0] - array[idx][0])
-        except IndexError:
-            # date out of bound, consider previous interval
-            totalsecs = timedelta_to_seconds(array[idx][0] - array[idx-1][0])
-        deltasecs = timedelta_to_seconds(date - array[idx][0])
+        # date out of bound, consider previous interval
+        nextidx = min(idx + 1, len(self.timestamps_array) - 1)
+        dates = self._dates_at([nextidx - 1, nextidx, idx])
+        totalsecs = timedelta_to_seconds((dates[1] - dates[0]).tolist())
+        deltasecs = timedelta_to_seconds(date - dates[2].tolist())
         return deltasecs / max(totalsecs, deltasecs)
 
+    def get_frac_offsets(self, dates):
+        """ vectorized version of `get_frac_offset` """
+        dates = numpy.asarray(dates, dtype='datetime64[us]')
+        indexes = self.get_rel_indexes(dates)
+        # dates out of bound consider the previous interval
+        nexts = numpy.minimum(indexes + 1, len(self.timestamps_array) - 1)
+        totalsecs = ((self._dates_at(nexts) - self._dates_at(nexts - 1))
+                     // numpy.timedelta64(1, 's'))
+        deltasecs = (dates - self._dates_at(indexes)) // numpy.timedelta64(1, 's')
+        return deltasecs / numpy.maximum(totalsecs, deltasecs)
+
     @property
+    @cached
     def _start_offset(self):
         return self.calendar.get_offset(self.start_date, self.granularity)
 
     def get_offset(self, datetime):
         timestamp = self.calendar.datetime_to_timestamp(datetime)
-        array = self.timestamps_array
-        idx = bisect_left(array, timestamp)
-        return idx
+        return int(self.timestamps_array.searchsorted(timestamp))
+
+    def get_offsets(self, dates):
+        """ vectorized version of `get_offset` """
+        timestamps = self.calendar.datetimes_to_timestamps(dates)
+        return numpy.searchsorted(self.timestamps_array, timestamps)
 
-    def cw_clear_all_caches(self):
-        super(NonPeriodicTimeSeries, self).cw_clear_all_caches()
+    def clear_data_caches(self):
+        super(NonPeriodicTimeSeries, self).clear_data_caches()
         if 'start_date' in vars(self):
             del self.start_date
         if 'timestamps_array' in vars(self):
             del self.timestamps_array
-        clear_cache(self, 'timestamped_array')
 
@@ -0,0 +1,44 @@
+"""rollup tiers of time series
+
+:organization: Logilab
+:copyright: 2009-2014 LOGILAB S.A. (Paris, FRANCE), license is LGPL v2.
+:contact: http://www.logilab.fr/ -- mailto:contact@logilab.fr
+:license: GNU Lesser General Public License, v2.1 - http://www.gnu.org/licenses
+"""
+from __future__ import division
+
+from logilab.common.decorators import cached, clear_cache
+
+from cubicweb.entities import AnyEntity, fetch_config
+
+from cubes.timeseries.entities import utils, abstract
+
+
+class TimeSeriesRollup(abstract.SharedArraysMixin, AnyEntity):
+    """ minimum, maximum, sum and count of the values of a time series over
+    each period of a coarser granularity, see `TimeSeries.compute_rollups`
+    """
+    __regid__ = 'TimeSeriesRollup'
+    fetch_attrs, cw_fetch_order = fetch_config(['granularity', 'start_date',
+                                                'modification_date'])
+
+    def get_array(self, attr):
+        """ return the decoded array of the given attribute (min_values,
+        max_values, sum_values or counts) """
+        return self._shared_array(attr, self._decoder(attr))
+
+    @property
+    def count(self):
+        return len(self.get_array('counts'))
+
+    @cached
+    def date_index(self):
+        """ return a datetime64 array holding the start date of each period """
+        return utils.get_date_range(self.granularity, self.start_date, self.count)
+
+    def averages(self):
+        return self.get_array('sum_values') / self.get_array('counts')
+
+    def cw_clear_all_caches(self):
+        super(TimeSeriesRollup, self).cw_clear_all_caches()
+        clear_cache(self, 'date_index')
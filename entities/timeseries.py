@@ -14,18 +14,20 @@ from math import floor, ceil
 
 import numpy
 
-from logilab.common.decorators import cached
+from logilab.common.decorators import cached, cachedproperty, clear_cache
 
-from cubicweb import _
+from cubicweb import Binary, _
 from cubicweb.entities import AnyEntity, fetch_config
 
+from cubes.timeseries import cache, storage
 from cubes.timeseries.calendars import get_calendar, TIME_DELTAS
 from cubes.timeseries.entities import utils, abstract
 
 
 class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
     __regid__ = 'TimeSeries'
-    fetch_attrs, cw_fetch_order = fetch_config(['data_type', 'unit', 'granularity', 'start_date'])
+    fetch_attrs, cw_fetch_order = fetch_config(['data_type', 'unit', 'granularity', 'start_date',
+                                                'modification_date'])
     _dtypes_in = {'Float': numpy.float64,
                   'Integer': numpy.int32,
                   'Boolean': numpy.bool}
@@ -48,20 +50,26 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
                           (self.dc_title(), self.start_date, self.count))
 
 
+    @cached
+    def date_index(self):
+        """ return a datetime64 array holding the date of each value """
+        # pylint:disable-msg=E1101
+        return utils.get_date_range(self.granularity, self.start_date, self.count)
+
     @cached
     def timestamped_array(self):
-        date = self.start_date  # pylint:disable-msg=E1101
-        data = []
-        for v in self.array:
-            data.append((date, self.output_value(v)))
-            date = self.get_next_date(date)
-        return data
+        """ return a list of (datetime, value) tuples
 
-    @property
+        This is kept for backward compatibility, use `date_index()` and
+        `array` where possible.
+        """
+        return list(zip(self.date_index().tolist(),
+                        self.output_values(self.array)))
+
+    @cachedproperty
     def end_date(self):
-        if self.granularity in TIME_DELTAS:
-            return self.start_date + self.count * TIME_DELTAS[self.granularity]
-        return self.get_next_date(self.timestamped_array()[-1][0])
+        # pylint:disable-msg=E1101
+        return utils.get_nth_date(self.granularity, self.start_date, self.count)
 
     def _check_intervals(self, intervals):
         for start, end in intervals:
@@ -83,66 +91,362 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
         if mode == 'last' and len(intervals) != 1 and not use_last_interval:
             raise ValueError('"last" aggregation method cannot be used with more than 1 interval')
         self._check_intervals(intervals)
-        values = []
-        flat_values = []
-        for start, end in intervals:
-            interval_date_values = self.get_by_date(slice(start, end), with_dates=True)
-            values.append((start, end, numpy.array(interval_date_values)))
-            interval_values = [date_value[1] for date_value in interval_date_values]
-            flat_values += interval_values
-            if len(interval_values) == 0:
-                raise IndexError()
-        flat_values = numpy.array(flat_values)
+        indexes = [self._interval_index(start, end) for start, end in intervals]
         start = intervals[0][0]
         end = intervals[-1][1]
+        value = self._rollup_value(intervals, mode)
+        if value is not None:
+            if mode in ('sum', 'average', 'weighted_average'):
+                return intervals[-1][0], value
+            return start, value
         if mode == 'last':
             last_index = self.get_rel_index(end - timedelta(seconds=1))
             tstamp = end - timedelta(seconds=1)
-            value = self.timestamped_array()[last_index][1]
+            value = self.output_value(self.read_array(last_index))
             return tstamp, value
-        elif mode == 'max':
-            return start, flat_values.max()
-        elif mode == 'min':
-            return start, flat_values.min()
-        elif mode == 'sum_realized':
+        elif mode in ('max', 'min', 'sum_realized'):
+            flat_values = numpy.concatenate([
+                self._output_array(self.read_array(index)) for index in indexes])
+            if mode == 'max':
+                return start, flat_values.max()
+            elif mode == 'min':
+                return start, flat_values.min()
             return start, flat_values.sum()
         elif mode in ('sum', 'average', 'weighted_average'):
-            nums = []
-            denoms = []
-            for start, end, interval_date_values in values:
-
-                interval_values = interval_date_values[:, 1]
-                coefs = numpy.ones(interval_values.shape, float)
-                start_frac = self.get_frac_offset(start)
-                end_frac = self.get_frac_offset(end)
-                coefs[0] -= start_frac
-                if end_frac != 0:
-                    coefs[-1] -= 1 - end_frac
-
-                if mode == 'weighted_average':
-                    interval_dates = interval_date_values[:, 0]
-                    weights = [self.get_duration_in_days(date)
-                               for date in interval_dates]
-                    coefs *= weights
-
-                num = (interval_values * coefs).sum()
-                nums.append(num)
-                denom = coefs.sum()
-                denoms.append(denom)
-
+            weighted = mode == 'weighted_average'
+            # fractions computed as the indexes, one date at a time
+            start_fracs = numpy.array([self.get_frac_offset(start) for start, _end in intervals])
+            end_fracs = numpy.array([self.get_frac_offset(end) for _start, end in intervals])
+            if self._prefix_sums_cached(weighted):
+                firsts = numpy.array([index.start for index in indexes])
+                stops = numpy.array([index.stop for index in indexes])
+                nums, denoms = self._interval_sums(firsts, stops, start_fracs, end_fracs,
+                                                   weighted)
+            else:
+                # building the prefix sums costs more than a few intervals
+                nums, denoms = self._slice_sums(indexes, start_fracs, end_fracs, weighted)
+            # the start of the last interval is returned here
+            start = intervals[-1][0]
             if mode == 'sum':
                 return start, sum(nums)
-            elif mode in ('average', 'weighted_average'):
-                return start, sum(nums) / sum(denoms)
+            return start, sum(nums) / sum(denoms)
         else:
             raise ValueError('unknown mode %s' % mode)
 
+    def aggregated_values(self, intervals, mode):
+        """ return an array holding the aggregated value of each (start, end)
+        interval, `intervals` being a sequence of pairs of dates or a datetime64
+        array of shape (n, 2)
+
+        This is the vectorized version of calling `aggregated_value` with each
+        interval, hence intervals may not be empty.
+        """
+        # pylint:disable-msg=E1101
+        assert mode in self.supported_modes, 'unsupported mode'
+        bounds = numpy.asarray(intervals, dtype='datetime64[us]').reshape(-1, 2)
+        starts, ends = bounds[:, 0], bounds[:, 1]
+        if self.is_constant:
+            if mode == 'sum':
+                raise ValueError("sum can't be computed with a constant granularity")
+            return numpy.full(len(bounds), self.first)
+        if (ends < numpy.datetime64(self.start_date, 'us')).any():
+            raise IndexError("some intervals end before the time series's "
+                             "start date (%s)" % self.start_date)
+        firsts, stops = self._rel_slices(starts, ends)
+        if (stops <= firsts).any():
+            raise IndexError('some intervals hold no value')
+        if mode == 'last':
+            indexes = self._rel_indexes(ends - numpy.timedelta64(1, 's'))
+            return self._output_array(self.read_array(indexes))
+        if mode in ('max', 'min'):
+            values = self._output_array(self.array)
+            reduce_ = numpy.maximum if mode == 'max' else numpy.minimum
+            # reduce [first, stop) pairs, stops may be the array's length
+            indexes = numpy.column_stack((firsts, stops)).ravel()
+            return reduce_.reduceat(numpy.append(values, values[:1]), indexes)[::2]
+        if mode == 'sum_realized':
+            cumvalues = self._prefix_sums()[0]
+            return cumvalues[stops] - cumvalues[firsts]
+        nums, denoms = self._interval_sums(firsts, stops,
+                                           self.get_frac_offsets(starts),
+                                           self.get_frac_offsets(ends),
+                                           mode == 'weighted_average')
+        if mode == 'sum':
+            return nums
+        return nums / denoms
+
+    def resample(self, granularity, mode):
+        """ return a new time series (not saved in the database) holding the
+        values aggregated with `mode` over each period of the given
+        granularity covered by this time series
+
+        Periods only partly covered by the time series are aggregated over
+        their covered part, as `aggregated_value` does. The granularity must
+        be coarser than the time series' one.
+        """
+        # pylint:disable-msg=E1101
+        assert mode in self.supported_modes, 'unsupported mode'
+        if self.is_constant:
+            raise ValueError("a constant time series can't be resampled")
+        granularities = self._granularities
+        if granularity not in granularities:
+            raise ValueError('unsupported granularity %s' % granularity)
+        if (self.granularity in granularities
+            and granularities.index(granularity) <= granularities.index(self.granularity)):
+            raise ValueError("a %s time series can't be resampled to %s values, "
+                             "which are not coarser" % (self.granularity, granularity))
+        bounds = self._resample_bounds(granularity)
+        values = self.aggregated_values(bounds, mode)
+        if mode in ('max', 'min', 'last'):
+            data_type = self.data_type
+        elif mode == 'sum_realized' and values.dtype.kind in 'biu':
+            data_type = u'Integer'
+        else:
+            data_type = u'Float'
+        start_date = self.calendar.get_period_start(self.start_date, granularity)
+        return self._new_series(granularity, start_date, data_type,
+                                values.astype(self._dtypes_in[data_type]))
+
+    def _resample_bounds(self, granularity):
+        """ return the datetime64 array of shape (n, 2) of the (start, end)
+        intervals of the periods of the given granularity covering this time
+        series, the last one ending at the end of the time series """
+        calendar = self.calendar
+        end_date = self.end_date
+        start = calendar.get_period_start(self.start_date, granularity)
+        count = int(ceil(calendar.get_offset(end_date, granularity)
+                         - calendar.get_offset(start, granularity)))
+        dates = utils.get_date_range(granularity, start, max(count, 1) + 1)
+        bounds = numpy.column_stack((dates[:-1], dates[1:]))
+        bounds[-1, 1] = min(bounds[-1, 1], numpy.datetime64(end_date, 'us'))
+        return bounds
+
+    def _new_series(self, granularity, start_date, data_type, values):
+        """ return a new periodic time series holding `values`, not saved in
+        the database """
+        series = self._cw.vreg['etypes'].etype_class('TimeSeries')(self._cw)
+        series.cw_attr_cache.update({'granularity': granularity,
+                                     'start_date': start_date,
+                                     'data_type': data_type,
+                                     'unit': self.unit,
+                                     'data': Binary(storage.encode_array(values))})
+        series.array = values
+        return series
+
+    # granularities from the finest to the coarsest
+    _granularities = ('15min', 'hourly', 'daily', 'weekly', 'monthly', 'yearly')
+
+    def compute_rollups(self, granularities):
+        """ return a list of dictionaries holding the attributes of the rollup
+        tiers (see `TimeSeriesRollup`) of the given granularities which are
+        coarser than this time series' one, values being arrays
+
+        Only 15min, hourly and daily time series starting at the start of a
+        period have rollup tiers, their periods being included in the periods
+        of coarser granularities.
+        """
+        # pylint:disable-msg=E1101
+        granularity = self.granularity
+        if (granularity not in ('15min', 'hourly', 'daily')
+            or self.calendar.get_period_start(self.start_date, granularity) != self.start_date):
+            return []
+        rank = self._granularities.index(granularity)
+        rollups = []
+        for tier_granularity in granularities:
+            if self._granularities.index(tier_granularity) <= rank:
+                continue
+            bounds = self._resample_bounds(tier_granularity)
+            firsts, stops = self._rel_slices(bounds[:, 0], bounds[:, 1])
+            start_date = self.calendar.get_period_start(self.start_date, tier_granularity)
+            rollups.append({'granularity': tier_granularity,
+                            'start_date': start_date,
+                            'min_values': self.aggregated_values(bounds, 'min'),
+                            'max_values': self.aggregated_values(bounds, 'max'),
+                            'sum_values': self.aggregated_values(bounds, 'sum_realized'),
+                            'counts': stops - firsts})
+        return rollups
+
+    @cached
+    def rollups(self):
+        """ return the rollup tiers of the time series, the coarsest first """
+        rank = self._granularities.index
+        return sorted(self.reverse_rollup_of,
+                      key=lambda rollup: rank(rollup.granularity), reverse=True)
+
+    def _rollup_value(self, intervals, mode):
+        """ return the value aggregated with `mode` over `intervals` from the
+        coarsest rollup tier whose periods start at the intervals' bounds,
+        else None
+
+        Values are then summed with a coefficient of 1, as the fractional
+        offsets of these bounds are 0, hence the result is the same.
+        """
+        if mode == 'last' or not self.cw_is_saved():
+            return None
+        calendar = self.calendar
+        dates = [date for interval in intervals for date in interval]
+        for rollup in self.rollups():
+            granularity = rollup.granularity
+            if any(calendar.get_period_start(date, granularity) != date
+                   for date in dates):
+                continue
+            offsets = (calendar.get_offsets(dates, granularity)
+                       - calendar.get_offset(rollup.start_date, granularity))
+            indexes = numpy.clip(numpy.rint(offsets), 0, rollup.count).astype(numpy.int64)
+            slices = [slice(first, stop)
+                      for first, stop in zip(indexes[::2], indexes[1::2])]
+            if any(index.stop <= index.start for index in slices):
+                return None
+            if mode in ('max', 'min'):
+                values = rollup.get_array('%s_values' % mode)
+                values = numpy.concatenate([values[index] for index in slices])
+                return values.max() if mode == 'max' else values.min()
+            sums = rollup.get_array('sum_values')
+            total = sum(sums[index].sum() for index in slices)
+            if mode == 'sum_realized':
+                return total
+            if mode == 'sum':
+                return numpy.float64(total)
+            counts = rollup.get_array('counts')
+            return total / sum(counts[index].sum() for index in slices)
+        return None
+
+    def _interval_index(self, start, end):
+        """ return the slice of indexes of values within [start, end), with
+        actual bounds """
+        index = self.get_rel_slice(slice(start, end))
+        first, stop, _step = index.indices(self.count)
+        if stop <= first:
+            raise IndexError()
+        return slice(first, stop)
+
+    def _rel_slices(self, starts, ends):
+        """ vectorized version of `_interval_index`, return arrays of first
+        and stop indexes """
+        start_offset = self._start_offset
+        firsts = numpy.floor(self.get_offsets(starts) - start_offset)
+        stops = numpy.ceil(self.get_offsets(ends) - start_offset)
+        firsts = numpy.maximum(firsts, 0).astype(numpy.int64)
+        stops = numpy.maximum(stops, 0).astype(numpy.int64)
+        if (firsts > self.count).any():
+            raise IndexError('start is too big')
+        return firsts, numpy.minimum(stops, self.count)
+
+    def _rel_indexes(self, dates):
+        """ vectorized version of `get_rel_index` """
+        indexes = numpy.floor(self.get_offsets(dates) - self._start_offset)
+        return indexes.astype(numpy.int64)
+
+    def _interval_sums(self, firsts, stops, start_fracs, end_fracs, weighted=False):
+        """ return arrays of the sums of the values of the slices [first, stop)
+        of values and of the sums of their coefficients
+
+        Values (and coefficients) are weighted by the duration of their
+        period when `weighted` is true, and the first and last values of each
+        slice by the fraction of their period within the interval (given by
+        the fractional offsets of the interval's bounds). Other values are
+        summed from prefix sums.
+        """
+        lasts = stops - 1
+        single = lasts == firsts
+        inner = lasts - firsts > 1
+        end_fracs = numpy.asarray(end_fracs, dtype=numpy.float64)
+        end_coefs = numpy.where(end_fracs != 0, 1 - end_fracs, 0)
+        first_coefs = 1 - numpy.asarray(start_fracs, dtype=numpy.float64)
+        first_coefs = numpy.where(single, first_coefs - end_coefs, first_coefs)
+        last_coefs = 1 - end_coefs
+        cumvalues, cumcoefs = self._prefix_sums(weighted)
+        first_values = self._output_array(self.read_array(firsts))
+        last_values = self._output_array(self.read_array(lasts))
+        if weighted:
+            weights = self._durations_in_days()
+            first_coefs = first_coefs * weights[firsts]
+            last_coefs = last_coefs * weights[lasts]
+        inners = firsts + 1
+        nums = (first_coefs * first_values
+                + numpy.where(inner, cumvalues[lasts] - cumvalues[inners], 0)
+                + numpy.where(single, 0, last_coefs * last_values))
+        denoms = (first_coefs
+                  + numpy.where(inner, cumcoefs[lasts] - cumcoefs[inners], 0)
+                  + numpy.where(single, 0, last_coefs))
+        return nums, denoms
+
+    def _slice_sums(self, indexes, start_fracs, end_fracs, weighted=False):
+        """ version of `_interval_sums` reading the values of each slice of
+        `indexes`, which only decodes the stored chunks holding them """
+        nums = []
+        denoms = []
+        for index, start_frac, end_frac in zip(indexes, start_fracs, end_fracs):
+            values = self._output_array(self.read_array(index))
+            coefs = numpy.ones(values.shape, numpy.float64)
+            coefs[0] -= start_frac
+            if end_frac != 0:
+                coefs[-1] -= 1 - end_frac
+            if weighted:
+                coefs *= self._durations_in_days(index)
+            nums.append((values * coefs).sum())
+            denoms.append(coefs.sum())
+        return nums, denoms
+
+    def _prefix_sums_cached(self, weighted=False):
+        """ return True if the prefix sums are in the shared cache of arrays
+        (they are not when larger than the whole cache) """
+        if not self.cw_is_saved():
+            return False
+        keys = ('data-wcumsum', 'weights-cumsum') if weighted else ('data-cumsum',)
+        return all(self._array_cache_key(key) in cache.ARRAY_CACHE for key in keys)
+
+    @cached
+    def _prefix_sums(self, weighted=False):
+        """ return cumulative sums of values (weighted by the duration of
+        their period if `weighted` is true) and of their coefficients (1 or
+        the duration of their period), both starting with 0 """
+        if not weighted:
+            cumvalues = self._shared_array('data-cumsum', self._cumsum_values)
+            return cumvalues, numpy.arange(len(cumvalues))
+        return (self._shared_array('data-wcumsum', self._cumsum_weighted_values),
+                self._shared_array('weights-cumsum', self._cumsum_weights))
+
+    def _cumsum_values(self):
+        values = self._output_array(self.array)
+        # integers sums are exact
+        dtype = numpy.int64 if values.dtype.kind in 'biu' else numpy.float64
+        return numpy.concatenate(([0], numpy.cumsum(values, dtype=dtype)))
+
+    def _cumsum_weighted_values(self):
+        values = self._output_array(self.array) * self._durations_in_days()
+        return numpy.concatenate(([0], numpy.cumsum(values)))
+
+    def _cumsum_weights(self):
+        return numpy.concatenate(([0], numpy.cumsum(self._durations_in_days())))
+
+    def _durations_in_days(self, index=slice(None)):
+        """ return the duration in days of the period of each value of the
+        `index` slice, see `get_duration_in_days` """
+        granularity = self.granularity  # pylint:disable-msg=E1101
+        if granularity in TIME_DELTAS:
+            first, stop, _step = index.indices(self.count)
+            days = self.get_duration_in_days(self.start_date)
+            return numpy.full(max(stop - first, 0), days, dtype=numpy.float64)
+        unit = {'monthly': 'M', 'yearly': 'Y'}[granularity]
+        periods = self.date_index()[index].astype('datetime64[%s]' % unit)
+        durations = (periods + 1).astype('datetime64[D]') - periods.astype('datetime64[D]')
+        return durations.astype(numpy.float64)
+
     def get_offset(self, date):
         return self.calendar.get_offset(date, self.granularity)
 
     def get_frac_offset(self, date):
         return self.calendar.get_frac_offset(date, self.granularity)
 
+    def get_offsets(self, dates):
+        """ vectorized version of `get_offset` """
+        return self.calendar.get_offsets(dates, self.granularity)
+
+    def get_frac_offsets(self, dates):
+        """ vectorized version of `get_frac_offset` """
+        return self.calendar.get_frac_offsets(dates, self.granularity)
+
     def get_duration_in_days(self, date):
         return self.calendar.get_duration_in_days(self.granularity, date)
 
@@ -157,27 +461,10 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
 
     def compressed_timestamped_array(self):
         """ eliminates duplicated values in piecewise constant timeseries """
-        data = self.timestamped_array()
-        compressed_data = [data[0]]
-        delta = timedelta(seconds=1)
-        last_date = data[-1][0]
-        if len(data) != 1:
-            for date, value in data[1:]:
-                previous_value = compressed_data[-1][1]
-                if value != previous_value:
-                    compressed_data.append((date - delta, previous_value))
-                    compressed_data.append((date, value))
-                if date == last_date:
-                    if value != previous_value:
-                        compressed_data.append((date, value))
-                        compressed_data.append((self.get_next_date(date), value))
-                    else:
-                        compressed_data.append((self.get_next_date(date), value))
-        else:
-            end_date = self.get_next_date(last_date)
-            value = data[-1][1]
-            compressed_data.append((end_date, value))
-        return compressed_data
+        dates, values = utils.step_points(self.date_index(),
+                                          self._output_array(self.array),
+                                          self.end_date)
+        return list(zip(dates.tolist(), values.tolist()))
 
     def python_value(self, v):
         self.warning('python_value is deprecated, use output_value instead')
@@ -190,6 +477,17 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
         """
         return self._dtypes_out[self.data_type](v)  # pylint:disable-msg=E1101
 
+    def output_values(self, values):
+        """ vectorized version of output_value, returns a list """
+        return self._output_array(values).tolist()
+
+    def _output_array(self, values):
+        values = numpy.asarray(values)
+        if self.data_type == 'Boolean':  # pylint:disable-msg=E1101
+            # same as utils.boolint
+            return (values.astype(numpy.float64) != 0).astype(int)
+        return values.astype(self._dtypes_out[self.data_type])  # pylint:disable-msg=E1101
+
     def input_value(self, v):
         """ if you need to update some data piecewise, use this
         to get it to the correct input type """
@@ -211,7 +509,7 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
 
     @property
     def first(self):
-        return self.array[0]
+        return self.read_array(0)
 
     @property
     def first_unit(self):
@@ -219,16 +517,12 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
 
     @property
     def last(self):
-        return self.array[-1]
+        return self.read_array(-1)
 
     @property
     def last_unit(self):
         return '%s%s' % (self.last, self.safe_unit)
 
-    @property
-    def count(self):
-        return self.array.size
-
     @property
     def min(self):
         return self.array.min()
@@ -270,19 +564,50 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
         return get_calendar(self.use_calendar)  # pylint:disable-msg=E1101
 
     def get_values_between(self, start_date, end_date):
+        """ return a datetime64 array of the dates of the values dated within
+        [start_date, end_date) and the array of these values, None bounds
+        standing for the start and the end of the time series
+
+        Only the values within the interval are read.
+        """
         # pylint:disable-msg=E1101
         if start_date is None:
             start_date = self.start_date
         if self.is_constant:
-            return [(start_date, self.first), ]
-        values = []
-        for tstamp, value in self.timestamped_array():
-            if tstamp < start_date:
-                continue
-            elif end_date is not None and tstamp >= end_date:
-                break
-            values.append((tstamp, value))
-        return values
+            return (numpy.array([start_date], dtype='datetime64[us]'),
+                    self._output_array(self.array[:1]))
+        start = self._first_index_from(start_date)
+        if end_date is None:
+            stop = self.count
+        else:
+            stop = max(start, self._first_index_from(end_date))
+        index = slice(start, stop)
+        return self._date_slice(index), self._output_array(self.read_array(index))
+
+    def _first_index_from(self, date):
+        """ return the index of the first value dated at or after `date` (the
+        number of values if there is none), as searching the date index would
+        """
+        # pylint:disable-msg=E1101
+        count = self.count
+        index = min(max(int(ceil(self.get_offset(date) - self._start_offset)), 0), count)
+        # offsets are not proportional to indexes for monthly and yearly time
+        # series, whose values are not all dated on the same day of month
+        nth_date = lambda index: utils.get_nth_date(self.granularity, self.start_date, index)
+        while index > 0 and nth_date(index - 1) >= date:
+            index -= 1
+        while index < count and nth_date(index) < date:
+            index += 1
+        return index
+
+    def _date_slice(self, index):
+        """ return self.date_index()[index] for a slice of positive bounds,
+        only computing the requested dates """
+        # pylint:disable-msg=E1101
+        start, stop, _step = index.indices(self.count)
+        return utils.get_date_range(self.granularity,
+                                    utils.get_nth_date(self.granularity, self.start_date, start),
+                                    max(stop - start, 0))
 
     def get_absolute(self, abs_index, with_dates=False):
         index = self._make_relative_index(abs_index)
@@ -293,28 +618,28 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
         abs_index = self.get_offset(date)
         return self._make_relative_index(abs_index)
 
+    def get_rel_slice(self, date_slice):
+        """ return the slice of relative indexes matching a slice of dates """
+        assert date_slice.step is None
+        if self.is_constant:
+            date_slice = slice(None, None)
+        if date_slice.start is None:
+            start = None
+        else:
+            start = self.get_offset(date_slice.start)
+        if date_slice.stop is None:
+            stop = None
+        else:
+            stop = self.get_offset(date_slice.stop)
+        return self._make_relative_index(slice(start, stop, None))
+
     def get_by_date(self, date, with_dates=False):
         # pylint:disable-msg=E1101
         if type(date) is slice:
-            assert date.step is None
-            if self.is_constant:
-                date = slice(None, None)
-            if date.start is None:
-                start = None
-            else:
-                # start = self.get_rel_index(date.start)
-                start = self.get_offset(date.start)
-            if date.stop is None:
-                stop = None
-            else:
-                # stop = self.get_rel_index(date.stop)
-                stop = self.get_offset(date.stop)
-            index = slice(start, stop, None)
+            index = self.get_rel_slice(date)
         else:
-            # index = self.get_rel_index(date)
-            index = self.get_offset(date)
-        # return self.get_relative(index, with_dates)
-        return self.get_absolute(index, with_dates)
+            index = self.get_rel_index(date)
+        return self.get_relative(index, with_dates)
 
     def _make_relative_index(self, abs_index):
         if isinstance(abs_index, (int, float)):
@@ -328,7 +653,7 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
                 stop = None
             else:
                 stop = max(0, int(ceil(abs_index.stop - self._start_offset)))
-            if start > len(self.array):
+            if start > self.count:
                 raise IndexError('start is too big')
             return slice(start, stop, abs_index.step)
         else:
@@ -337,9 +662,13 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
     def get_relative(self, index, with_dates=False):
         try:
             if with_dates:
-                return self.timestamped_array()[index]
+                dates = self.date_index()[index].tolist()
+                values = self.output_values(self.read_array(index))
+                if isinstance(index, slice):
+                    return list(zip(dates, values))
+                return dates, values
             else:
-                return self.array[index]
+                return self.read_array(index)
         except IndexError as exc:
             raise IndexError(exc.args + (index,))
 
@@ -348,5 +677,18 @@ class TimeSeries(abstract.AbstractTSMixin, AnyEntity):
     def _start_offset(self):
         return self.get_offset(self.start_date)
 
+    def clear_data_caches(self):
+        super(TimeSeries, self).clear_data_caches()
+        clear_cache(self, 'date_index')
+        clear_cache(self, 'timestamped_array')
+        clear_cache(self, '_prefix_sums')
+        clear_cache(self, '_start_offset')
+        if 'end_date' in vars(self):
+            del self.end_date
+
+    def cw_clear_all_caches(self):
+        super(TimeSeries, self).cw_clear_all_caches()
+        clear_cache(self, 'rollups')
+
 
 
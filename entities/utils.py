@@ -1,4 +1,12 @@
+import bz2
 import datetime
+import os.path as osp
+import shutil
+import tempfile
+import zlib
+
+import numpy
+from numpy.lib import format as npformat
 
 from cubes.timeseries.calendars import TIME_DELTAS
 
@@ -23,6 +31,41 @@ except ImportError:
 else:
     HANDLE_XLSX = True
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    HANDLE_ARROW = False
+    HANDLE_PARQUET = False
+else:
+    HANDLE_ARROW = True
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        HANDLE_PARQUET = False
+    else:
+        HANDLE_PARQUET = True
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        HANDLE_XZ = False
+    else:
+        HANDLE_XZ = True
+else:
+    HANDLE_XZ = True
+
+# streaming decompressors of the supported compressed file extensions
+DECOMPRESSORS = {'.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                 '.bz2': bz2.BZ2Decompressor}
+DECOMPRESSION_ERRORS = (zlib.error, IOError, EOFError)
+if HANDLE_XZ:
+    DECOMPRESSORS['.xz'] = lzma.LZMADecompressor
+    DECOMPRESSION_ERRORS += (lzma.LZMAError,)
+
 
 def boolint(value):
     """ ensuring such boolean like values
@@ -86,3 +129,490 @@ def get_next_year(date):
         return datetime.datetime.combine(newdate, date.time())
     else:
         return date
+
+
+def get_date_range(granularity, start_date, count):
+    """ return a datetime64 array of the `count` dates obtained by
+    successive calls to get_next_date, starting from start_date
+    """
+    start = numpy.datetime64(start_date, 'us')
+    if granularity in TIME_DELTAS:
+        step = numpy.timedelta64(TIME_DELTAS[granularity], 'us')
+        return start + numpy.arange(count) * step
+    elif granularity == 'monthly':
+        return _shift_months(start, numpy.arange(count))
+    elif granularity == 'yearly':
+        return _shift_months(start, numpy.arange(count) * 12)
+    elif granularity == 'constant':
+        return start + numpy.arange(count) * numpy.timedelta64(1, 'us')
+    else:
+        raise ValueError(granularity)
+
+def get_nth_date(granularity, start_date, index):
+    """ return the date obtained by `index` successive calls to get_next_date,
+    starting from start_date, without computing the intermediate dates
+    """
+    if granularity in TIME_DELTAS:
+        return start_date + index * TIME_DELTAS[granularity]
+    elif granularity in ('monthly', 'yearly'):
+        step = 12 if granularity == 'yearly' else 1
+        # the day of month is clamped to the shortest month met, and the
+        # first 4 years hold a 28 days long february: later months never
+        # clamp it further
+        months = numpy.append(numpy.arange(min(index, 48)), index) * step
+        return _shift_months(numpy.datetime64(start_date, 'us'), months)[-1].tolist()
+    else:
+        return get_date_range(granularity, start_date, index + 1)[-1].tolist()
+
+def _shift_months(start, months):
+    """ shift the start datetime64 by an array of month counts
+
+    get_next_month and get_next_year clamp the day of the *previous* date
+    to the length of the new month, hence once a day has been clamped it
+    never grows back: this is a running minimum
+    """
+    day = start.astype('datetime64[D]')
+    month = start.astype('datetime64[M]')
+    day_of_month = (day - month.astype('datetime64[D]')).astype(int) + 1
+    time_of_day = start - day
+    target_months = month + months
+    month_starts = target_months.astype('datetime64[D]')
+    month_lengths = ((target_months + 1).astype('datetime64[D]') - month_starts).astype(int)
+    days = numpy.minimum.accumulate(numpy.minimum(month_lengths, day_of_month))
+    return month_starts + (days - 1) + time_of_day
+
+
+class FloatParseError(ValueError):
+    """ raised by `parse_floats`, `index` being the position of the first
+    string which is not a number """
+
+    def __init__(self, index, string):
+        super(FloatParseError, self).__init__(
+            'could not convert %r to float' % string)
+        self.index = index
+        self.string = string
+
+def _clean_number(string, decimal_separator, thousands_separator):
+    if thousands_separator:
+        string = string.replace(thousands_separator, '')
+    return string.replace(decimal_separator, '.')
+
+def parse_floats(strings, decimal_separator='.', thousands_separator=''):
+    """ return a float64 array of the numbers written in `strings`, using
+    the given separators
+
+    Separators are replaced on the whole block of text at once, and numpy
+    converts the resulting strings without a python level loop. Raise
+    `FloatParseError` on the first string which is not a number.
+    """
+    text = _clean_number('\n'.join(strings), decimal_separator, thousands_separator)
+    cleaned = text.split('\n')
+    if len(cleaned) == len(strings):
+        try:
+            return numpy.array(cleaned).astype(numpy.float64)
+        except ValueError:
+            pass
+    else:
+        # some strings hold a new line, hence are not numbers: find them
+        cleaned = [_clean_number(string, decimal_separator, thousands_separator)
+                   for string in strings]
+    values = numpy.empty(len(strings))
+    for index, string in enumerate(cleaned):
+        try:
+            values[index] = float(string)
+        except ValueError:
+            raise FloatParseError(index, strings[index])
+    # numpy may be stricter than python about some spellings
+    return values
+
+
+def guess_datetime_format(sample, formats):
+    """ return the first of the strptime `formats` the `sample` string
+    matches """
+    for format in formats:
+        try:
+            datetime.datetime.strptime(sample, format)
+        except ValueError:
+            continue
+        return format
+    raise ValueError('%r matches none of the formats %s'
+                     % (sample, ', '.join(formats)))
+
+# width of the zero padded fields parse_datetimes decodes itself
+_DATETIME_FIELDS = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2}
+
+def parse_datetimes(strings, format):
+    """ return a datetime64[us] array of the dates written in `strings` with
+    the strptime `format`
+
+    Formats made of the zero padded numeric fields of `_DATETIME_FIELDS` are
+    decoded with array arithmetic on the characters, others (or strings not
+    laid out as expected) go through strptime.
+    """
+    dates = _parse_fixed_width_datetimes(strings, format)
+    if dates is None:
+        strptime = datetime.datetime.strptime
+        dates = numpy.array([strptime(string, format) for string in strings],
+                            dtype='datetime64[us]')
+    return dates
+
+def _fixed_width_layout(format):
+    """ return the (start, stop) position of each field of `format`, the
+    (position, character) of its literal characters and its width, or None
+    if the format holds other directives """
+    fields = {}
+    literals = []
+    position = index = 0
+    while index < len(format):
+        if format[index] == '%':
+            directive = format[index:index + 2]
+            if directive not in _DATETIME_FIELDS or directive in fields:
+                return None
+            width = _DATETIME_FIELDS[directive]
+            fields[directive] = (position, position + width)
+            position += width
+            index += 2
+        else:
+            literals.append((position, ord(format[index])))
+            position += 1
+            index += 1
+    if not ('%Y' in fields and '%m' in fields and '%d' in fields):
+        return None
+    return fields, literals, position
+
+def _parse_fixed_width_datetimes(strings, format):
+    layout = _fixed_width_layout(format)
+    array = numpy.asarray(strings)
+    if layout is None or array.dtype.kind not in 'SU' or not len(array):
+        return None
+    fields, literals, width = layout
+    charsize = 4 if array.dtype.kind == 'U' else 1
+    if array.dtype.itemsize != width * charsize:
+        return None
+    # one row of character codes per string, shorter strings being padded
+    # with null characters which match neither digits nor literals
+    codes = array.view('u%d' % charsize).reshape(len(array), width)
+    for position, code in literals:
+        if (codes[:, position] != code).any():
+            return None
+    digits = codes.astype(numpy.int64) - ord('0')
+    values = {}
+    for directive, (start, stop) in fields.items():
+        field = digits[:, start:stop]
+        if ((field < 0) | (field > 9)).any():
+            return None
+        values[directive] = field.dot(10 ** numpy.arange(stop - start - 1, -1, -1))
+    zeros = numpy.zeros(len(array), dtype=numpy.int64)
+    years, months, days = values['%Y'], values['%m'], values['%d']
+    hours = values.get('%H', zeros)
+    minutes = values.get('%M', zeros)
+    seconds = values.get('%S', zeros)
+    if not ((years >= 1) & (months >= 1) & (months <= 12) & (days >= 1)
+            & (hours < 24) & (minutes < 60) & (seconds < 60)).all():
+        return None
+    month_starts = ((years - 1970) * 12 + months - 1).astype('datetime64[M]')
+    month_lengths = ((month_starts + 1).astype('datetime64[D]')
+                     - month_starts.astype('datetime64[D]')).astype(numpy.int64)
+    if (days > month_lengths).any():
+        return None
+    seconds = (((days - 1) * 24 + hours) * 60 + minutes) * 60 + seconds
+    return (month_starts.astype('datetime64[us]')
+            + seconds.astype('timedelta64[s]'))
+
+
+def format_datetimes(dates, format):
+    """ return the list of the dates of the `dates` datetime64 array, as
+    strings formatted with the strftime `format`
+
+    Formats made of the fields of `_DATETIME_FIELDS` are written with array
+    arithmetic into a character array, others go through strftime.
+    """
+    dates = numpy.asarray(dates, dtype='datetime64[us]')
+    layout = _fixed_width_layout(format)
+    if layout is None or not len(dates) or max(format) > '\x7f':
+        return [date.strftime(format) for date in dates.tolist()]
+    fields, literals, width = layout
+    days = dates.astype('datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    years = dates.astype('datetime64[Y]')
+    seconds = (dates - days) // numpy.timedelta64(1, 's')
+    values = {'%Y': years.astype(numpy.int64) + 1970,
+              '%m': (months - years.astype('datetime64[M]')).astype(numpy.int64) + 1,
+              '%d': (days - months.astype('datetime64[D]')).astype(numpy.int64) + 1,
+              '%H': seconds // 3600,
+              '%M': seconds // 60 % 60,
+              '%S': seconds % 60}
+    if not ((values['%Y'] >= 1000) & (values['%Y'] <= 9999)).all():
+        # strftime does not pad years below 1000 the same on every platform
+        return [date.strftime(format) for date in dates.tolist()]
+    chars = numpy.empty((len(dates), width), dtype=numpy.uint8)
+    for position, code in literals:
+        chars[:, position] = code
+    for directive, (start, stop) in fields.items():
+        value = values[directive]
+        for position in range(stop - 1, start - 1, -1):
+            chars[:, position] = ord('0') + value % 10
+            value = value // 10
+    return chars.view('S%d' % width).ravel().astype(str).tolist()
+
+def format_numbers(values, decimal_separator='.'):
+    """ return the list of the numbers of the `values` array as strings,
+    written with the given decimal separator, as `str` writes them
+
+    (astype(str) is not used: it writes float32 values and, depending on
+    numpy's version, float64 values differently)
+    """
+    strings = list(map(str, numpy.asarray(values).tolist()))
+    if decimal_separator != '.' and strings:
+        strings = '\n'.join(strings).replace('.', decimal_separator).split('\n')
+    return strings
+
+def step_points(dates, values, end_date):
+    """ return the datetime64 array of the dates and the array of the values
+    of the points drawing `values` as steps, each value holding from its
+    date to the next one (to `end_date` for the last one)
+
+    Repeated values are merged: each change of value yields two points, the
+    end of the previous plateau (one second before) and the start of the new
+    one.
+    """
+    dates = numpy.asarray(dates, dtype='datetime64[us]')
+    values = numpy.asarray(values)
+    if not len(values):
+        return dates, values
+    changes = numpy.flatnonzero(values[1:] != values[:-1]) + 1
+    out_dates = numpy.empty(2 * len(changes) + 1, dtype=dates.dtype)
+    out_values = numpy.empty(2 * len(changes) + 1, dtype=values.dtype)
+    out_dates[0], out_values[0] = dates[0], values[0]
+    out_dates[1::2] = dates[changes] - numpy.timedelta64(1, 's')
+    out_values[1::2] = values[changes - 1]
+    out_dates[2::2] = dates[changes]
+    out_values[2::2] = values[changes]
+    last_dates = [numpy.datetime64(end_date, 'us')]
+    if len(changes) and changes[-1] == len(values) - 1:
+        last_dates.insert(0, dates[-1])
+    return (numpy.append(out_dates, last_dates),
+            numpy.append(out_values, [values[-1]] * len(last_dates)))
+
+def datetimes_to_ticks(dates):
+    """ vectorized `logilab.common.date.datetime2ticks`: return the int64
+    array of the milliseconds since the epoch of the `dates` """
+    return numpy.asarray(dates, dtype='datetime64[ms]').astype(numpy.int64)
+
+def lttb_indexes(x, y, threshold):
+    """ return the indexes of the at most `threshold` points of the (x, y)
+    curve kept by the Largest-Triangle-Three-Buckets algorithm
+
+    The first and last points are kept, the others are split into buckets
+    of consecutive points, keeping in each one the point forming the largest
+    triangle with the point kept in the previous bucket and the average
+    point of the next one.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    count = len(y)
+    threshold = max(threshold, 3)
+    if threshold >= count:
+        return numpy.arange(count)
+    buckets = threshold - 2
+    edges = numpy.arange(buckets + 1) * (count - 2) // buckets + 1
+    sizes = numpy.diff(edges)
+    # average point of the next bucket, the last point for the last bucket
+    next_x = numpy.append(numpy.add.reduceat(x[1:-1], edges[:-1] - 1)[1:] / sizes[1:], x[-1])
+    next_y = numpy.append(numpy.add.reduceat(y[1:-1], edges[:-1] - 1)[1:] / sizes[1:], y[-1])
+    indexes = numpy.empty(threshold, dtype=numpy.intp)
+    indexes[0], indexes[-1] = 0, count - 1
+    kept = 0
+    for bucket in range(buckets):
+        start, stop = edges[bucket], edges[bucket + 1]
+        # twice the area of the triangles, up to the sign
+        areas = numpy.abs((x[kept] - next_x[bucket]) * (y[start:stop] - y[kept])
+                          - (x[kept] - x[start:stop]) * (next_y[bucket] - y[kept]))
+        kept = start + int(areas.argmax())
+        indexes[bucket + 1] = kept
+    return indexes
+
+def minmax_indexes(y, buckets):
+    """ return the sorted indexes of the first and last values of `y` and of
+    the minimum and maximum of each of `buckets` buckets of consecutive
+    values, whose plot draws the envelope of the full curve """
+    y = numpy.asarray(y)
+    count = len(y)
+    buckets = max(buckets, 1)
+    if 2 * buckets + 2 >= count:
+        return numpy.arange(count)
+    starts = numpy.arange(buckets) * count // buckets
+    stops = numpy.append(starts[1:], count)
+    # sorting by bucket then value puts the minimum of each bucket at its
+    # start and the maximum at its end
+    order = numpy.lexsort((y, numpy.repeat(numpy.arange(buckets), stops - starts)))
+    return numpy.unique(numpy.concatenate(([0, count - 1], order[starts], order[stops - 1])))
+
+def load_npy(file):
+    """ return the array of the .npy `file`, memory mapped rather than read
+    when the file is on disk """
+    try:
+        file.fileno()
+    except (AttributeError, ValueError, EnvironmentError):
+        return npformat.read_array(file, allow_pickle=False)
+    version = npformat.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = npformat.read_array_header_1_0(file)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = npformat.read_array_header_2_0(file)
+    else:
+        file.seek(0)
+        return npformat.read_array(file, allow_pickle=False)
+    if dtype.hasobject:
+        raise ValueError('arrays of python objects are not supported')
+    if not numpy.prod(shape, dtype=numpy.int64):
+        # empty files can't be mapped
+        return numpy.empty(shape, dtype=dtype)
+    return numpy.memmap(file, dtype=dtype, mode='r', shape=shape,
+                        offset=file.tell(), order='F' if fortran_order else 'C')
+
+class UploadedFile(object):
+    """ a data file to import, read by chunks by the `source_to_numpy_array`
+    converters instead of being held in memory as a Binary
+
+    As the Binary set by the data form field, it has a `filename` attribute
+    and behaves as a file object.
+    """
+    # size of the chunks copied when spooling an upload
+    chunk_size = 64 * 1024
+
+    def __init__(self, file, filename):
+        self.file = file
+        self.filename = filename
+
+    @classmethod
+    def spool(cls, stream, filename):
+        """ copy the uploaded `stream` to an anonymous temporary file, removed
+        once closed """
+        spooled = tempfile.TemporaryFile(prefix='timeseries-upload-')
+        shutil.copyfileobj(stream, spooled, cls.chunk_size)
+        spooled.seek(0)
+        return cls(spooled, filename)
+
+    @classmethod
+    def from_path(cls, path):
+        """ import the file at `path`, without copying it """
+        return cls(open(path, 'rb'), osp.basename(path))
+
+    @property
+    def size(self):
+        position = self.file.tell()
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        self.file.seek(position)
+        return size
+
+    def getvalue(self):
+        """ return the whole content, as Binary.getvalue (yams checks Bytes
+        values have this method) """
+        position = self.file.tell()
+        self.file.seek(0)
+        data = self.file.read()
+        self.file.seek(position)
+        return data
+
+    def __getattr__(self, attr):
+        # read, seek, fileno, close...
+        return getattr(self.file, attr)
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+def iter_chunks(file, compression=None, chunk_size=1024*1024):
+    """ yield the content of `file` by chunks, decompressed on the fly if
+    `compression` is one of the `DECOMPRESSORS` extensions
+
+    Concatenated compressed streams (e.g. multi-member gzip files) are all
+    decompressed, invalid or truncated ones raise a ValueError.
+    """
+    if not compression:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    decompressor = DECOMPRESSORS[compression]()
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            while chunk:
+                if decompressor.eof:
+                    # start of the next stream
+                    decompressor = DECOMPRESSORS[compression]()
+                yield decompressor.decompress(chunk)
+                chunk = decompressor.unused_data if decompressor.eof else b''
+    except DECOMPRESSION_ERRORS as exc:
+        raise ValueError('invalid %s compressed data (%s)' % (compression, exc))
+    if not decompressor.eof:
+        raise ValueError('truncated %s compressed data' % compression)
+
+def iter_line_blocks(chunks):
+    """ regroup byte `chunks` into blocks of whole lines, each ending with a
+    new line """
+    rest = b''
+    for chunk in chunks:
+        chunk = rest + chunk
+        end = chunk.rfind(b'\n') + 1
+        rest = chunk[end:]
+        if end:
+            yield chunk[:end]
+    if rest:
+        yield rest + b'\n'
+
+# characters str.split() splits on, by ascii code
+_SPACES = numpy.zeros(256, dtype=bool)
+_SPACES[[ord(char) for char in ' \t\n\r\x0b\x0c']] = True
+
+def last_fields(block):
+    """ return a bytes array of the last whitespace separated field of each
+    non blank line of the `block` of lines, and the indexes of these lines
+
+    The fields are located with array operations on the characters, then
+    copied at once into a fixed width array.
+    """
+    chars = numpy.frombuffer(block, dtype=numpy.uint8)
+    spaces = _SPACES[chars]
+    newlines = numpy.flatnonzero(chars == ord('\n'))
+    line_starts = numpy.append(0, newlines[:-1] + 1)
+    # strip the trailing spaces of the lines having some
+    ends = newlines.copy()
+    trailing = numpy.flatnonzero(ends > line_starts)
+    while len(trailing):
+        trailing = trailing[spaces[ends[trailing] - 1]]
+        ends[trailing] -= 1
+        trailing = trailing[ends[trailing] > line_starts[trailing]]
+    lines = numpy.flatnonzero(ends > line_starts)
+    ends = ends[lines]
+    # fields start after the last space before their end, if any
+    spaces = numpy.flatnonzero(spaces)
+    index = numpy.searchsorted(spaces, ends)
+    starts = numpy.where(index > 0, spaces[numpy.maximum(index - 1, 0)] + 1, 0)
+    lengths = ends - starts
+    width = max(lengths.max() if len(lengths) else 0, 1)
+    columns = numpy.arange(width)
+    fields = chars[numpy.minimum(starts[:, None] + columns, len(chars) - 1)]
+    fields[columns >= lengths[:, None]] = 0
+    return fields.view('S%d' % width).ravel(), lines
+
+def fields_to_floats(fields):
+    """ return a float64 array of the numbers in the `fields` bytes array
+    (see `last_fields`), raise `FloatParseError` on the first which is not a
+    number """
+    try:
+        return fields.astype(numpy.float64)
+    except ValueError:
+        for index, field in enumerate(fields):
+            try:
+                float(field)
+            except ValueError:
+                raise FloatParseError(index, field)
+        # numpy may be stricter than python about some spellings
+        return numpy.array([float(field) for field in fields])
@@ -1,7 +1,11 @@
+import os.path as osp
+
 from cubicweb import ValidationError
-from cubicweb.server.hook import Hook
+from cubicweb.server.hook import Hook, Operation, DataOperationMixIn
 from cubicweb.predicates import is_instance
 
+from cubes.timeseries import cache
+
 class TimeSeriesDataReadHook(Hook):
     __regid__ = 'timeseries_data_read_hook'
     __select__ = Hook.__select__ & is_instance('TimeSeries', 'NonPeriodicTimeSeries')
@@ -13,6 +17,55 @@ class TimeSeriesDataReadHook(Hook):
         if 'data' in entity.cw_edited:
             importer = entity.cw_adapt_to('TimeSeriesImporter')
             importer.grok_data()
+        elif 'codec' in entity.cw_edited:
+            importer = entity.cw_adapt_to('TimeSeriesImporter')
+            importer.recode()
+
+class TimeSeriesRollupHook(Hook):
+    """ compute again the rollup tiers of time series whose values changed """
+    __regid__ = 'timeseries_rollup_hook'
+    __select__ = Hook.__select__ & is_instance('TimeSeries')
+    events = ('after_add_entity', 'after_update_entity')
+    category = 'timeseries'
+
+    def __call__(self):
+        entity = self.entity
+        if set(('data', 'granularity', 'start_date')) & set(entity.cw_edited):
+            importer = entity.cw_adapt_to('TimeSeriesImporter')
+            # rollup tiers are maintained whoever changes the time series
+            with self._cw.security_enabled(read=False, write=False):
+                importer.update_rollups(self._cw.vreg.config['timeseries-rollups'])
+
+class ArrayCacheSetupHook(Hook):
+    __regid__ = 'timeseries_array_cache_setup'
+    events = ('server_startup',)
+    category = 'timeseries'
+
+    def __call__(self):
+        config = self.repo.config
+        cache.setup_array_cache(config['timeseries-cache'],
+                                config['timeseries-cache-size'],
+                                osp.join(config.appdatahome, 'timeseries-cache'))
+
+class ArrayCacheInvalidationHook(Hook):
+    """ drop decoded arrays of modified or deleted time series and rollup
+    tiers (rewritten when their time series changes) from the shared cache,
+    now and once the transaction is committed (concurrent readers may have
+    cached the former data meanwhile) """
+    __regid__ = 'timeseries_array_cache_invalidation'
+    __select__ = Hook.__select__ & is_instance('TimeSeries', 'NonPeriodicTimeSeries',
+                                               'TimeSeriesRollup')
+    events = ('after_update_entity', 'after_delete_entity')
+    category = 'timeseries'
+
+    def __call__(self):
+        cache.ARRAY_CACHE.invalidate(self.entity.eid)
+        ArrayCacheInvalidationOp.get_instance(self._cw).add_data(self.entity.eid)
+
+class ArrayCacheInvalidationOp(DataOperationMixIn, Operation):
+
+    def postcommit_event(self):
+        cache.ARRAY_CACHE.invalidate(*self.get_data())
 
 class ConstantTimeSeriesValidationHook(Hook):
     __regid__ = 'constant_ts_hook'
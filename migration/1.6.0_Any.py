@@ -0,0 +1,58 @@
+from cubicweb import Binary
+
+from cubes.timeseries import storage
+
+add_attribute('TimeSeries', 'codec')
+add_attribute('NonPeriodicTimeSeries', 'codec')
+
+
+# rewrite time series stored as pickles (or pickled chunks) using the raw
+# binary format of cubes.timeseries.storage, `attrs` mapping each attribute
+# to the filters which may be applied to it
+def upgrade_storage(etype, attrs, batch_size=100):
+    rset = rql('Any X WHERE X is %s' % etype, ask_confirm=False)
+    for idx, entity in enumerate(rset.entities()):
+        edited = {}
+        codec = storage.available_codec(
+            entity.codec or config.get('timeseries-codec', storage.DEFAULT_CODEC))
+        for attr, filters in attrs.items():
+            value = getattr(entity, attr)
+            if value is None:
+                continue
+            raw_data = value.getvalue()
+            if storage.needs_upgrade(raw_data):
+                array = storage.decode_array(raw_data)
+                filter = storage.choose_filter(array, filters, codec)
+                edited[attr] = Binary(storage.encode_array(array, codec=codec,
+                                                           filter=filter))
+        if edited:
+            entity.cw_set(**edited)
+        entity.cw_clear_all_caches()
+        if idx % batch_size == batch_size - 1:
+            commit(ask_confirm=False)
+    commit(ask_confirm=False)
+
+
+# the timeseries hooks would compute the rollup tiers before their entity
+# type exists, they are computed once by add_rollups below
+with cnx.allow_all_hooks_but('timeseries'):
+    upgrade_storage('TimeSeries', {'data': (None,)})
+    upgrade_storage('NonPeriodicTimeSeries', {'data': (None, 'xor'),
+                                              'timestamps': ('dod',)})
+
+
+add_entity_type('TimeSeriesRollup')
+
+# compute the rollup tiers of existing time series (see TimeSeriesRollupHook)
+def add_rollups(batch_size=100):
+    granularities = config['timeseries-rollups']
+    rset = rql('Any X WHERE X is TimeSeries', ask_confirm=False)
+    for idx, entity in enumerate(rset.entities()):
+        entity.cw_adapt_to('TimeSeriesImporter').update_rollups(granularities)
+        entity.cw_clear_all_caches()
+        if idx % batch_size == batch_size - 1:
+            commit(ask_confirm=False)
+    commit(ask_confirm=False)
+
+
+add_rollups()
@@ -21,6 +21,10 @@ class _AbstractTimeSeries(EntityType):
 
     data = Bytes(required=True,
                  description = _('Timeseries data'))
+    codec = String(maxsize=8,
+                   vocabulary = [u'none', u'zlib', u'lz4', u'zstd'],
+                   description=_('compression codec of the stored data, '
+                                 'defaults to the instance configuration'))
 
 class TimeSeries(_AbstractTimeSeries):
     """Periodic Timeseries, defined with a start date and a fixed
@@ -47,6 +51,31 @@ class NonPeriodicTimeSeries(_AbstractTimeSeries):
                        description = _('the array of timestamps. Mandatory but read from the same source as data'))
 
 
+class TimeSeriesRollup(EntityType):
+    """Values of a periodic time series aggregated over the periods of a
+    coarser granularity, maintained by hooks"""
+    granularity = String(required=True,
+                         internationalizable=True,
+                         vocabulary = [_('hourly'), _('daily'), _('weekly'),
+                                       _('monthly'), _('yearly')])
+    start_date = Datetime(required=True)
+    min_values = Bytes(required=True,
+                       description=_('minimum value of each period'))
+    max_values = Bytes(required=True,
+                       description=_('maximum value of each period'))
+    sum_values = Bytes(required=True,
+                       description=_('sum of the values of each period'))
+    counts = Bytes(required=True,
+                   description=_('number of values of each period'))
+
+class rollup_of(RelationDefinition):
+    subject = 'TimeSeriesRollup'
+    object = 'TimeSeries'
+    composite = 'object'
+    cardinality = '1*'
+    inlined = True
+
+
 class ExcelPreferences(EntityType):
     # thousands: input only
     thousands_separator = String(maxsize=1, default=u'')
@@ -0,0 +1,40 @@
+"""report the compression ratio and decoding speed of each available codec
+on the time series stored in an instance
+
+usage: cubicweb-ctl shell <instance> codec_report.py [<max number of series>]
+"""
+from __future__ import print_function
+
+import time
+
+from cubes.timeseries import storage
+
+limit = int(__args__[0]) if __args__ else 100
+
+arrays = []
+for etype, attrs in (('TimeSeries', ('data',)),
+                     ('NonPeriodicTimeSeries', ('data', 'timestamps'))):
+    rset = rql('Any X WHERE X is %s LIMIT %s' % (etype, limit))
+    for entity in rset.entities():
+        for attr in attrs:
+            value = getattr(entity, attr)
+            if value is not None:
+                arrays.append(storage.decode_array(value.getvalue()))
+        entity.cw_clear_all_caches()
+
+raw_size = sum(array.nbytes for array in arrays)
+print('%d arrays, %d values, %.1f MB uncompressed' % (
+    len(arrays), sum(len(array) for array in arrays), raw_size / 1e6))
+print('%-8s %10s %8s %14s' % ('codec', 'size (MB)', 'ratio', 'decode (MB/s)'))
+for codec in sorted(storage.CODECS):
+    blobs = [storage.encode_array(array, codec=codec) for array in arrays]
+    size = sum(len(blob) for blob in blobs)
+    best = None
+    for _run in range(3):
+        start = time.time()
+        for blob in blobs:
+            storage.decode_array(blob)
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    print('%-8s %10.2f %8.2f %14.1f' % (codec, size / 1e6, raw_size / max(size, 1),
+                                       raw_size / 1e6 / max(best, 1e-9)))
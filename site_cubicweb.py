@@ -0,0 +1,37 @@
+options = (
+    ('timeseries-codec',
+     {'type': 'string',
+      'default': 'zlib',
+      'help': 'compression codec used to store time series data when not '
+      'specified on the time series itself: none, zlib, lz4 or zstd (lz4 and '
+      'zstd require the python library of the same name, zlib is used when '
+      'the codec is not available)',
+      'group': 'timeseries', 'level': 2,
+      }),
+    ('timeseries-cache',
+     {'type': 'choice',
+      'choices': ('memory', 'mmap'),
+      'default': 'memory',
+      'help': 'where decoded time series arrays are cached: "memory" keeps '
+      'them in each process, "mmap" stores them in files of the instance data '
+      'directory which are memory-mapped by all processes of the host',
+      'group': 'timeseries', 'level': 2,
+      }),
+    ('timeseries-cache-size',
+     {'type': 'bytes',
+      'default': '64MB',
+      'help': 'maximum size of the decoded time series arrays kept in memory '
+      'and shared by all requests of a process (or by all processes of the '
+      'host for the "mmap" cache), 0 to disable this cache',
+      'group': 'timeseries', 'level': 2,
+      }),
+    ('timeseries-rollups',
+     {'type': 'csv',
+      'default': 'hourly,daily,monthly',
+      'help': 'granularities of the rollup tiers (minimum, maximum, sum and '
+      'count of the values of each period) stored for 15min, hourly and daily '
+      'time series, used to compute aggregated values over whole periods and '
+      'to plot long time series; empty to disable them',
+      'group': 'timeseries', 'level': 2,
+      }),
+)
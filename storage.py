@@ -0,0 +1,318 @@
+"""chunked storage of time series arrays
+
+Arrays are split into chunks of `CHUNK_SIZE` values which are compressed
+separately, so that reading a range of values only decodes the chunks
+overlapping it.
+
+Layout of a stored blob (integers are little endian)::
+
+  magic | version | codec | filter | dtype | chunk size | length |
+  chunk count | directory | chunks
+
+where the directory holds the end offset of each chunk (uint64), relative
+to the start of the first chunk, and each chunk holds the raw bytes of its
+values compressed with the codec (see `register_codec`, zlib is always
+available). Decoding them is a `numpy.frombuffer` call on the decompressed
+bytes, without any intermediate copy nor unpickling.
+
+An optional filter may be applied to each chunk before compression, to
+make its bytes more compressible (see `FILTERS`):
+
+* 'dod' stores the delta of delta of the values' bit patterns, which is
+  mostly zeros for nearly regular timestamps,
+
+* 'xor' stores the xor of each value's bit pattern with the previous one,
+  which has many zero bits for slowly varying float values.
+
+Both end with a byte shuffle (all first bytes, then all second bytes...)
+grouping the zero bytes together.
+
+Blobs of the original format (a possibly compressed pickle of the whole
+array) are still read, see `needs_upgrade`.
+"""
+import struct
+import zlib
+import pickle
+
+import numpy
+
+MAGIC = b'CWTS'
+VERSION = 1
+CHUNK_SIZE = 2 ** 14
+DEFAULT_CODEC = 'zlib'
+
+_PREFIX = struct.Struct('<4sB')
+_HEADER = struct.Struct('<4sB8s8s8sIQI')
+
+# name: (compress, decompress)
+CODECS = {}
+
+
+def register_codec(name, compress, decompress):
+    """register a compression codec, `name` being recorded in stored blobs"""
+    assert len(name) <= 8, 'codec name is too long'
+    CODECS[name] = (compress, decompress)
+
+
+def available_codec(name):
+    """return `name` if this codec is available, else the default codec"""
+    if name in CODECS:
+        return name
+    return DEFAULT_CODEC
+
+
+register_codec('none', bytes, bytes)
+register_codec('zlib', zlib.compress, zlib.decompress)
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    register_codec('lz4', lz4.frame.compress, lz4.frame.decompress)
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    # (de)compressor objects are not thread safe
+    register_codec('zstd',
+                   lambda data: zstandard.ZstdCompressor().compress(data),
+                   lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+def _int_dtype(dtype, kind):
+    """return the integer dtype of same size and byte order as `dtype`"""
+    return numpy.dtype('%s%s%d' % (dtype.byteorder, kind, dtype.itemsize))
+
+
+def _shuffle(array):
+    return array.view(numpy.uint8).reshape(-1, array.itemsize).T.tobytes()
+
+
+def _unshuffle(raw_data, dtype):
+    bytes_ = numpy.frombuffer(raw_data, dtype=numpy.uint8)
+    return bytes_.reshape(dtype.itemsize, -1).T.copy().view(dtype).ravel()
+
+
+def _dod_encode(array):
+    ints = array.view(_int_dtype(array.dtype, 'i'))
+    # integer arithmetic wraps around, hence this is lossless
+    deltas = numpy.diff(ints, prepend=ints.dtype.type(0))
+    return _shuffle(numpy.diff(deltas, prepend=ints.dtype.type(0)))
+
+
+def _dod_decode(raw_data, dtype):
+    dods = _unshuffle(raw_data, _int_dtype(dtype, 'i'))
+    return numpy.cumsum(numpy.cumsum(dods, dtype=dods.dtype),
+                        dtype=dods.dtype).view(dtype)
+
+
+def _xor_encode(array):
+    bits = array.view(_int_dtype(array.dtype, 'u'))
+    xored = bits.copy()
+    xored[1:] ^= bits[:-1]
+    return _shuffle(xored)
+
+
+def _xor_decode(raw_data, dtype):
+    xored = _unshuffle(raw_data, _int_dtype(dtype, 'u'))
+    return numpy.bitwise_xor.accumulate(xored).view(dtype)
+
+
+# name: (encode array to bytes, decode bytes and dtype to array)
+FILTERS = {'dod': (_dod_encode, _dod_decode),
+           'xor': (_xor_encode, _xor_decode)}
+
+
+def choose_filter(array, filters, codec=DEFAULT_CODEC, sample=CHUNK_SIZE):
+    """return the filter of `filters` (None meaning no filter) with which the
+    first `sample` values of `array` compress best
+
+    Float values do not always gain from the xor filter (e.g. piecewise
+    constant or rounded values compress better as they are).
+    """
+    sample = numpy.ascontiguousarray(array[:sample])
+    if sample.dtype.kind not in 'biuf':
+        return None
+    compress = CODECS[codec][0]
+    sizes = []
+    for filter in filters:
+        if filter is None:
+            raw_data = sample.tobytes()
+        else:
+            raw_data = FILTERS[filter][0](sample)
+        sizes.append((len(compress(raw_data)), filter is not None))
+    return filters[sizes.index(min(sizes))]
+
+
+def encode_array(array, chunk_size=CHUNK_SIZE, codec=DEFAULT_CODEC,
+                 filter=None):
+    """return the bytes to be stored for a 1-dimensional numpy array"""
+    array = numpy.ascontiguousarray(array)
+    if array.dtype.hasobject:
+        raise TypeError('can not store an array of python objects')
+    if filter is not None and array.dtype.kind not in 'biuf':
+        filter = None
+    compress = CODECS[codec][0]
+    if filter is None:
+        to_bytes = lambda chunk: chunk.tobytes()
+    else:
+        to_bytes = FILTERS[filter][0]
+    chunks = [compress(to_bytes(array[start:start + chunk_size]))
+              for start in range(0, len(array), chunk_size)]
+    ends = numpy.cumsum([len(chunk) for chunk in chunks], dtype='<u8')
+    header = _HEADER.pack(MAGIC, VERSION, codec.encode('ascii'),
+                                    (filter or '').encode('ascii'),
+                                    array.dtype.str.encode('ascii'),
+                                    chunk_size, len(array), len(chunks))
+    return b''.join([header, ends.tobytes()] + chunks)
+
+
+def decode_array(raw_data):
+    """return the whole numpy array stored in `raw_data`"""
+    return ChunkedArray(raw_data).read()
+
+
+def needs_upgrade(raw_data):
+    """tell whether `raw_data` was written in an older format"""
+    if raw_data[:len(MAGIC)] != MAGIC:
+        return True
+    return _PREFIX.unpack_from(raw_data)[1] != VERSION
+
+
+def _decode_legacy(raw_data):
+    try:
+        raw_data = zlib.decompress(raw_data)
+    except zlib.error:
+        # assume uncompressed data
+        pass
+    return pickle.loads(raw_data)
+
+
+class ChunkedArray(object):
+    """read access to a stored array, decoding only the chunks which are
+    actually needed
+
+    Supports `len()` and indexing by integer, integer array or slice (with a
+    step of 1).
+    Decoded chunks are kept for subsequent reads. Returned arrays may be
+    read-only views on the stored bytes.
+    """
+    codec = None
+    filter = None
+    dtype = None
+
+    def __init__(self, raw_data):
+        self.raw_data = raw_data
+        self._chunks = {}
+        if raw_data[:len(MAGIC)] != MAGIC:
+            array = _decode_legacy(raw_data)
+            self.version = 0
+            self.dtype = array.dtype
+            self.chunk_size = max(len(array), 1)
+            self.length = len(array)
+            self._ends = numpy.array([0], dtype='<u8')
+            self._chunks[0] = array
+            return
+        self.version = _PREFIX.unpack_from(raw_data)[1]
+        if self.version != VERSION:
+            raise ValueError('unsupported time series storage version %s'
+                             % self.version)
+        (_magic, _version, codec, filter, dtype, self.chunk_size,
+         self.length, nchunks) = _HEADER.unpack_from(raw_data)
+        self.codec = codec.rstrip(b'\0').decode('ascii')
+        self.filter = filter.rstrip(b'\0').decode('ascii') or None
+        self.dtype = numpy.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        self._ends = numpy.frombuffer(raw_data, dtype='<u8', count=nchunks,
+                                      offset=_HEADER.size)
+        self._base = _HEADER.size + self._ends.nbytes
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nchunks(self):
+        return len(self._ends)
+
+    def _chunk_bounds(self, num):
+        start = self._base + (int(self._ends[num - 1]) if num else 0)
+        return start, self._base + int(self._ends[num])
+
+    def chunk(self, num):
+        """return the decoded chunk of index `num`"""
+        try:
+            return self._chunks[num]
+        except KeyError:
+            start, end = self._chunk_bounds(num)
+            if self.codec == 'none' and self.filter is None:
+                count = (end - start) // self.dtype.itemsize
+                chunk = numpy.frombuffer(self.raw_data, dtype=self.dtype,
+                                         count=count, offset=start)
+            else:
+                try:
+                    decompress = CODECS[self.codec][1]
+                except KeyError:
+                    raise ValueError('time series codec %s is not available'
+                                     % self.codec)
+                raw_chunk = decompress(self.raw_data[start:end])
+                if self.filter is None:
+                    chunk = numpy.frombuffer(raw_chunk, dtype=self.dtype)
+                else:
+                    chunk = FILTERS[self.filter][1](raw_chunk, self.dtype)
+            self._chunks[num] = chunk
+            return chunk
+
+    def read(self, start=0, stop=None):
+        """return values from start to stop (python slice semantics,
+        without step)"""
+        start, stop, _step = slice(start, stop).indices(self.length)
+        if stop <= start:
+            return numpy.empty(0, dtype=self.dtype)
+        if self.codec == 'none' and self.filter is None:
+            # uncompressed chunks are contiguous
+            return numpy.frombuffer(self.raw_data, dtype=self.dtype,
+                                    count=stop - start,
+                                    offset=self._base + start * self.dtype.itemsize)
+        first = start // self.chunk_size
+        last = (stop - 1) // self.chunk_size
+        offset = first * self.chunk_size
+        if first == last:
+            return self.chunk(first)[start - offset:stop - offset]
+        parts = [self.chunk(num) for num in range(first, last + 1)]
+        return numpy.concatenate(parts)[start - offset:stop - offset]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                return self.read()[index]
+            return self.read(index.start, index.stop)
+        if numpy.ndim(index):
+            return self.take(index)
+        index = int(index)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('index %s is out of bounds' % index)
+        chunk = self.chunk(index // self.chunk_size)
+        return chunk[index % self.chunk_size]
+
+    def take(self, indexes):
+        """return values at the given (integer array) indexes"""
+        indexes = numpy.asarray(indexes, dtype=numpy.int64)
+        indexes = numpy.where(indexes < 0, indexes + self.length, indexes)
+        if len(indexes) and not (0 <= indexes.min() and indexes.max() < self.length):
+            raise IndexError('index is out of bounds')
+        values = numpy.empty(indexes.shape, dtype=self.dtype)
+        nums = indexes // self.chunk_size
+        # group indexes by chunk
+        order = numpy.argsort(nums, kind='mergesort')
+        groups = numpy.split(order, numpy.flatnonzero(numpy.diff(nums[order])) + 1)
+        if len(groups) > self.nchunks // 2:
+            return self.read()[indexes]
+        for group in groups:
+            if len(group):
+                chunk = self.chunk(nums[group[0]])
+                values[group] = chunk[indexes[group] % self.chunk_size]
+        return values
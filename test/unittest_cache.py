@@ -0,0 +1,108 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy
+
+# this import is for apycot
+import cubicweb.devtools
+
+from cubes.timeseries.cache import ArrayCache, MmapArrayCache
+
+
+class ArrayCacheTC(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = ArrayCache(max_size=1000)
+        self.assertIsNone(cache.get((1, None, 'data')))
+        array = numpy.arange(10, dtype=numpy.float64)
+        cached = cache.put((1, None, 'data'), array)
+        self.assertFalse(cached.flags.writeable)
+        # the original array is left untouched
+        self.assertTrue(array.flags.writeable)
+        self.assertEqual(cache.get((1, None, 'data')).tolist(), array.tolist())
+        self.assertRaises(ValueError, cache.get((1, None, 'data')).__setitem__,
+                          0, 1.)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertEqual(stats['size'], 80)
+
+    def test_lru(self):
+        cache = ArrayCache(max_size=200)
+        for eid in range(3):
+            cache.put((eid, None, 'data'), numpy.zeros(10))
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn((0, None, 'data'), cache)
+        # use 1, hence 2 is the least recently used
+        cache.get((1, None, 'data'))
+        cache.put((3, None, 'data'), numpy.zeros(10))
+        self.assertIn((1, None, 'data'), cache)
+        self.assertNotIn((2, None, 'data'), cache)
+        self.assertEqual(cache.stats()['evictions'], 2)
+        # too large to be cached
+        cache.put((4, None, 'data'), numpy.zeros(100))
+        self.assertNotIn((4, None, 'data'), cache)
+        cache.resize(100)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 80)
+
+    def test_invalidate(self):
+        cache = ArrayCache()
+        cache.put((1, 'd1', 'data'), numpy.zeros(10))
+        cache.put((1, 'd1', 'timestamps'), numpy.zeros(10))
+        cache.put((2, 'd1', 'data'), numpy.zeros(10))
+        cache.invalidate(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 80)
+        cache.invalidate(1, 2)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+class MmapArrayCacheTC(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared(self):
+        key = (1, datetime(2014, 1, 2, 3, 4, 5, 6), 'data')
+        cache1 = MmapArrayCache(self.directory)
+        cache2 = MmapArrayCache(self.directory)
+        self.assertIsNone(cache2.get(key))
+        array = numpy.arange(10, dtype=numpy.float64)
+        cached = cache1.put(key, array)
+        self.assertFalse(cached.flags.writeable)
+        self.assertEqual(cached.tolist(), array.tolist())
+        # the second "process" maps the array written by the first one
+        shared = cache2.get(key)
+        self.assertFalse(shared.flags.writeable)
+        self.assertEqual(shared.tolist(), array.tolist())
+        self.assertIn(key, cache2)
+        self.assertEqual(cache2.stats()['hits'], 1)
+        self.assertEqual(cache2.stats()['misses'], 1)
+        # invalidation is seen by all processes
+        cache1.invalidate(1)
+        self.assertNotIn(key, cache2)
+        self.assertIsNone(cache2.get(key))
+
+    def test_lru(self):
+        # .npy files have a header of 128 bytes
+        cache = MmapArrayCache(self.directory, max_size=500)
+        for eid in range(3):
+            cache.put((eid, None, 'data'), numpy.zeros(10))
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn((0, None, 'data'), cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 416)
+        cache.put((3, None, 'data'), numpy.zeros(100))
+        self.assertNotIn((3, None, 'data'), cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,23 @@ from datetime import datetime
 
 import unittest
 
+import numpy
+
 # this import is for apycot
 import cubicweb.devtools
 
-from cubes.timeseries.calendars import GregorianCalendar
+from cubes.timeseries.calendars import AbstractCalendar, GregorianCalendar
+
+
+class OrdinalCalendar(AbstractCalendar):
+    """ a calendar only implementing the scalar methods, and not calling
+    AbstractCalendar.__init__ """
+
+    def __init__(self, name='ordinal'):
+        self.name = name
+
+    def ordinal(self, date):
+        return date.toordinal()
 
 
 class GasCalendarDateFunctionsTC(unittest.TestCase):
@@ -49,6 +62,38 @@ class GasCalendarDateFunctionsTC(unittest.TestCase):
     def test_2(self):
         self.assertEqual(self.calendar.timestamp_to_datetime(self.calendar.datetime_to_timestamp(datetime(1990, 1, 1, 1, 1, 2))),
                          datetime(1990, 1, 1, 1, 1, 2))
+    def test_offset_15min(self):
+        offset = self.calendar.get_offset(datetime(2009, 10, 28), '15min')
+        self.assertEqual(self.calendar.get_offset(datetime(2009, 10, 28, 12, 35), '15min'),
+                         offset + 50 + 5/15.)
+
+    def test_vectorized_offsets(self):
+        dates = [datetime(1969, 12, 31, 23, 59, 59, 999999),
+                 datetime(2000, 2, 29, 12, 30), datetime(2009, 10, 28, 4, 10, 3),
+                 datetime(2012, 12, 31, 23, 59)]
+        for granularity in ('15min', 'hourly', 'daily', 'weekly', 'monthly',
+                            'yearly', 'time_vector', 'constant'):
+            offsets = self.calendar.get_offsets(numpy.array(dates, dtype='datetime64[us]'),
+                                                granularity)
+            self.assertEqual(offsets.tolist(),
+                             [self.calendar.get_offset(date, granularity) for date in dates])
+            frac_offsets = self.calendar.get_frac_offsets(dates, granularity)
+            self.assertEqual(frac_offsets.tolist(),
+                             [self.calendar.get_frac_offset(date, granularity) for date in dates])
+        timestamps = self.calendar.datetimes_to_timestamps(dates)
+        self.assertEqual(timestamps.tolist(),
+                         [self.calendar.datetime_to_timestamp(date) for date in dates])
+
+    def test_scalar_offsets_fallback(self):
+        calendar = OrdinalCalendar()
+        dates = [datetime(2000, 2, 29, 12, 30), datetime(2009, 10, 28, 4, 10, 3)]
+        for granularity in ('15min', 'hourly', 'daily', 'weekly', 'monthly',
+                            'yearly', 'time_vector', 'constant'):
+            self.assertEqual(calendar.get_offsets(dates, granularity).tolist(),
+                             [calendar.get_offset(date, granularity) for date in dates])
+            self.assertEqual(calendar.get_frac_offsets(dates, granularity).tolist(),
+                             [calendar.get_frac_offset(date, granularity) for date in dates])
+
 
 if __name__ == '__main__':
     unittest.main()
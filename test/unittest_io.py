@@ -1,8 +1,13 @@
+import bz2
+import gzip
+import unittest
+import zipfile
 from datetime import datetime
+from io import BytesIO
 
 import numpy
 
-from cubicweb import Binary, NoSelectableObject
+from cubicweb import Binary, NoSelectableObject, ValidationError
 from cubicweb.devtools.testlib import CubicWebTC
 
 from cubes.timeseries.entities import utils
@@ -12,6 +17,10 @@ def is_supported(ext):
         return utils.HANDLE_XLS
     if ext == '.xlsx':
         return utils.HANDLE_XLSX
+    if ext == '.arrow':
+        return utils.HANDLE_ARROW
+    if ext == '.parquet':
+        return utils.HANDLE_PARQUET
     return True
 
 class TimeSeriesTC(CubicWebTC):
@@ -42,7 +51,8 @@ class RoundTripTC(TimeSeriesTC):
             req.cnx.commit()
             for ext, fmt in (('.xls', 'application/vnd.ms-excel'),
                              ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
-                             ('.csv', 'text/csv')):
+                             ('.csv', 'text/csv'),
+                             ('.npy', 'application/x-npy')):
                 try:
                     exporter = self.vreg['adapters'].select('ITimeSeriesExporter', req,
                                                             entity=ts, mimetype=fmt)
@@ -51,13 +61,27 @@ class RoundTripTC(TimeSeriesTC):
                 out = exporter.export()
                 self.failIf(len(out) == 0)
 
+    @unittest.skipUnless(utils.HANDLE_XLSX, 'openpyxl is not available')
+    def test_xlsx_date_format(self):
+        with self.admin_access.web_request() as req:
+            ts = self._create_ts(req, granularity=u'daily')
+            req.cnx.commit()
+            exporter = self.vreg['adapters'].select(
+                'ITimeSeriesExporter', req, entity=ts,
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            sheet = utils.openpyxl.load_workbook(BytesIO(exporter.export())).active
+            datecell = next(iter(sheet.rows))[0]
+            self.assertEqual(datecell.value, datetime(2009, 10, 1))
+            self.assertNotEqual(datecell.number_format, 'General')
+
     def test_npts_export(self):
         with self.admin_access.web_request() as req:
             ts = self._create_npts(req)
             req.cnx.commit()
             for ext, fmt in (('.xls', 'application/vnd.ms-excel'),
                              ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
-                             ('.csv', 'text/csv')):
+                             ('.csv', 'text/csv'),
+                             ('.npy', 'application/x-npy')):
                 try:
                     exporter = self.vreg['adapters'].select('ITimeSeriesExporter', req,
                                                             entity=ts, mimetype=fmt)
@@ -84,6 +108,100 @@ class RoundTripTC(TimeSeriesTC):
                                        data=blob)
                 self.assertEqual(orig.timestamped_array(), ts.timestamped_array())
 
+    def test_ts_import_uploaded_file(self):
+        with self.admin_access.repo_cnx() as cnx:
+            orig = self._create_ts(cnx, granularity=u'daily')
+            cnx.commit()
+            for ext in ('.xls', '.xlsx', '.csv'):
+                if not is_supported(ext):
+                    continue
+                upload = utils.UploadedFile.from_path(self.datapath('ts' + ext))
+                ts = cnx.create_entity('TimeSeries',
+                                       granularity=u'daily',
+                                       start_date=datetime(2009, 10, 1),
+                                       data=upload)
+                self.assertEqual(orig.timestamped_array(), ts.timestamped_array())
+                self.assertTrue(upload.closed)
+
+    def test_ts_import_unsupported_uploaded_file(self):
+        with self.admin_access.repo_cnx() as cnx:
+            upload = utils.UploadedFile(BytesIO(b'1\n2\n'), u'ts.doc')
+            with self.assertRaises(ValidationError):
+                cnx.create_entity('TimeSeries', granularity=u'daily',
+                                  start_date=datetime(2009, 10, 1), data=upload)
+            self.assertTrue(upload.closed)
+
+    def test_ts_import_compressed_txt(self):
+        with self.admin_access.repo_cnx() as cnx:
+            orig = self._create_ts(cnx, granularity=u'daily')
+            cnx.commit()
+            with open(self.datapath('ts.csv'), 'rb') as txt:
+                content = txt.read()
+            gzipped = BytesIO()
+            with gzip.GzipFile(fileobj=gzipped, mode='wb') as gzfile:
+                gzfile.write(content)
+            compressed = {'.gz': gzipped.getvalue(), '.bz2': bz2.compress(content)}
+            if utils.HANDLE_XZ:
+                compressed['.xz'] = utils.lzma.compress(content)
+            for ext, data in compressed.items():
+                blob = Binary(data)
+                blob.filename = 'ts.txt' + ext
+                ts = cnx.create_entity('TimeSeries',
+                                       granularity=u'daily',
+                                       start_date=datetime(2009, 10, 1),
+                                       data=blob)
+                self.assertEqual(orig.timestamped_array(), ts.timestamped_array())
+
+    def _roundtrip(self, cnx, orig, mimetype, **kwargs):
+        exporter = self.vreg['adapters'].select('ITimeSeriesExporter', cnx,
+                                                entity=orig, mimetype=mimetype)
+        blob = Binary(b''.join(exporter.export_blocks()))
+        blob.filename = exporter.filename
+        return cnx.create_entity(orig.cw_etype, data=blob, **kwargs)
+
+    def test_ts_roundtrip(self):
+        with self.admin_access.repo_cnx() as cnx:
+            orig = self._create_ts(cnx, data=numpy.random.rand(100),
+                                   granularity=u'hourly')
+            cnx.commit()
+            for ext, mimetype in (('.xls', 'application/vnd.ms-excel'),
+                                  ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+                                  ('.csv', 'text/csv'),
+                                  ('.npy', 'application/x-npy'),
+                                  ('.arrow', 'application/vnd.apache.arrow.file'),
+                                  ('.parquet', 'application/vnd.apache.parquet')):
+                if not is_supported(ext):
+                    continue
+                ts = self._roundtrip(cnx, orig, mimetype, granularity=u'hourly',
+                                     start_date=orig.start_date)
+                numpy.testing.assert_array_equal(orig.array, ts.array)
+
+    def test_npts_roundtrip(self):
+        with self.admin_access.repo_cnx() as cnx:
+            orig = self._create_npts(cnx)
+            cnx.commit()
+            ts = self._roundtrip(cnx, orig, 'application/x-npy')
+            self.assertEqual(orig.timestamped_array(), ts.timestamped_array())
+            blob = BytesIO()
+            numpy.save(blob, numpy.arange(10.))
+            blob = Binary(blob.getvalue())
+            blob.filename = 'ts.npy'
+            self.assertRaises(ValidationError, cnx.create_entity,
+                              'NonPeriodicTimeSeries', data=blob)
+
+    def test_npts_arrow_roundtrip(self):
+        with self.admin_access.repo_cnx() as cnx:
+            orig = self._create_npts(cnx)
+            orig.cw_set(unit=u'kW')
+            cnx.commit()
+            for ext, mimetype in (('.arrow', 'application/vnd.apache.arrow.file'),
+                                  ('.parquet', 'application/vnd.apache.parquet')):
+                if not is_supported(ext):
+                    continue
+                ts = self._roundtrip(cnx, orig, mimetype)
+                self.assertEqual(orig.timestamped_array(), ts.timestamped_array())
+                self.assertEqual(u'kW', ts.unit)
+
     def test_npts_import(self):
         with self.admin_access.repo_cnx() as cnx:
             orig = self._create_npts(cnx)
@@ -97,7 +215,149 @@ class RoundTripTC(TimeSeriesTC):
                 ts = cnx.create_entity('NonPeriodicTimeSeries', data=blob)
                 self.assertEqual(orig.timestamped_array(), ts.timestamped_array())
 
+class CSVImportTC(TimeSeriesTC):
+
+    def _import(self, entity, content, **kwargs):
+        blob = Binary(content)
+        blob.filename = 'data.csv'
+        adapter = self.vreg['adapters'].select('source_to_numpy_array', entity._cw,
+                                               entity=entity, filename='data.csv')
+        adapter.block_size = 2
+        return adapter.to_numpy_array(blob, 'data.csv', **kwargs)
+
+    def _new(self, req, etype='TimeSeries'):
+        return self.vreg['etypes'].etype_class(etype)(req)
+
+    def test_blocks(self):
+        with self.admin_access.web_request() as req:
+            values = self._import(self._new(req), b'1.5\n2\n3\n-4.25\n5\n',
+                                  dialect='excel-tab')
+            self.assertEqual([1.5, 2, 3, -4.25, 5], values.tolist())
+
+    def test_separators(self):
+        with self.admin_access.web_request() as req:
+            prefs = req.user.format_preferences[0]
+            prefs.cw_set(decimal_separator=u',', thousands_separator=u' ')
+            values = self._import(self._new(req), b'value\n1,5\n2 000,25\n3\n',
+                                  dialect='excel-tab')
+            self.assertEqual([1.5, 2000.25, 3], values.tolist())
+
+    def test_invalid_value(self):
+        with self.admin_access.web_request() as req:
+            with self.assertRaises(ValueError) as cm:
+                self._import(self._new(req), b'1\n2\n3\noops\n5\n',
+                             dialect='excel-tab')
+            self.assertEqual('Invalid data type for value oops on line 4 of data.csv',
+                             str(cm.exception))
+
+    def test_npts_timestamps(self):
+        with self.admin_access.web_request() as req:
+            ts = self._new(req, 'NonPeriodicTimeSeries')
+            # the last block mixes the datetime and date formats
+            values = self._import(ts, b'2009/10/01 00:00\t1\n2009/10/01 12:00\t2\n'
+                                  b'2009/10/02 06:00\t3\n2009/10/03 00:00\t4\n'
+                                  b'2009/10/04\t5\n', dialect='excel-tab')
+            self.assertEqual([1, 2, 3, 4, 5], values.tolist())
+            self.assertEqual([datetime(2009, 10, 1), datetime(2009, 10, 1, 12),
+                              datetime(2009, 10, 2, 6), datetime(2009, 10, 3),
+                              datetime(2009, 10, 4)],
+                             ts.cw_attr_cache['timestamps'].tolist())
+
+
+class BulkExportTC(TimeSeriesTC):
+
+    def test_zip(self):
+        with self.admin_access.web_request() as req:
+            eids = [self._create_ts(req, data=numpy.arange(10) * i,
+                                    granularity=u'daily').eid for i in range(3)]
+            req.cnx.commit()
+            rset = req.execute('Any X WHERE X is TimeSeries')
+            archive = zipfile.ZipFile(BytesIO(req.view('tszipexport', rset)))
+            self.assertEqual(sorted('ts_%s.csv' % eid for eid in eids),
+                             sorted(archive.namelist()))
+            # exported data is not kept until the end of the export
+            for entity in rset.entities():
+                self.assertNotIn('data', entity.cw_attr_cache)
+
+    def test_wide(self):
+        with self.admin_access.web_request() as req:
+            self._create_ts(req, granularity=u'daily')
+            self._create_ts(req, granularity=u'daily', start_date=datetime(2009, 10, 6))
+            req.cnx.commit()
+            rset = req.execute('Any X ORDERBY X WHERE X is TimeSeries')
+            lines = req.view('tswideexport', rset).decode('utf-8').splitlines()
+            self.assertEqual(1 + 15, len(lines))
+            self.assertEqual(['2009/10/01', '0.0', ''], lines[1].split('\t'))
+            self.assertEqual(['2009/10/06', '5.0', '0.0'], lines[6].split('\t'))
+            self.assertEqual(['2009/10/15', '', '9.0'], lines[-1].split('\t'))
+
+
+class IterChunksTC(unittest.TestCase):
+    content = b''.join(b'%d\n' % i for i in range(1000))
+
+    def _chunks(self, data, compression):
+        return b''.join(utils.iter_chunks(BytesIO(data), compression, chunk_size=100))
+
+    def test_multiple_streams(self):
+        half = len(self.content) // 2
+        gzipped = BytesIO()
+        for part in (self.content[:half], self.content[half:]):
+            with gzip.GzipFile(fileobj=gzipped, mode='wb') as gzfile:
+                gzfile.write(part)
+        self.assertEqual(self._chunks(gzipped.getvalue(), '.gz'), self.content)
+        bzipped = bz2.compress(self.content[:half]) + bz2.compress(self.content[half:])
+        self.assertEqual(self._chunks(bzipped, '.bz2'), self.content)
+
+    def test_truncated(self):
+        gzipped = BytesIO()
+        with gzip.GzipFile(fileobj=gzipped, mode='wb') as gzfile:
+            gzfile.write(self.content)
+        for data, compression in ((gzipped.getvalue(), '.gz'),
+                                  (bz2.compress(self.content), '.bz2')):
+            self.assertRaises(ValueError, self._chunks, data[:-20], compression)
+
+
+class LastFieldsTC(unittest.TestCase):
+
+    def test_last_fields(self):
+        fields, lines = utils.last_fields(b'1\n\n2009/10/02 2.5  \r\n \nfoo\tbar\n')
+        self.assertEqual([b'1', b'2.5', b'bar'], fields.tolist())
+        self.assertEqual([0, 2, 4], lines.tolist())
+
+    def test_line_blocks(self):
+        chunks = [b'1\n2', b'', b'.5\n', b'3']
+        self.assertEqual([b'1\n', b'2.5\n', b'3\n'], list(utils.iter_line_blocks(chunks)))
+
+
+class ParseDatetimesTC(unittest.TestCase):
+
+    def test_fixed_width(self):
+        dates = utils.parse_datetimes([u'01/02/2012 10:30:15', u'29/02/2012 23:59:59'],
+                                      '%d/%m/%Y %H:%M:%S')
+        self.assertEqual([datetime(2012, 2, 1, 10, 30, 15), datetime(2012, 2, 29, 23, 59, 59)],
+                         dates.tolist())
+
+    def test_not_padded(self):
+        dates = utils.parse_datetimes([u'2012/2/1', u'2012/10/01'], '%Y/%m/%d')
+        self.assertEqual([datetime(2012, 2, 1), datetime(2012, 10, 1)], dates.tolist())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, utils.parse_datetimes,
+                          [u'2012/02/01', u'2013/02/29'], '%Y/%m/%d')
+
+
+class FormatNumbersTC(unittest.TestCase):
+
+    def test_as_str(self):
+        for values in (numpy.array([0.1 + 0.2, 1/3., 1e16, 1e-5, 100., -0.]),
+                       numpy.array([1.1, 2.2], dtype=numpy.float32),
+                       numpy.arange(-3, 3)):
+            # the former formatting of each value
+            expected = [str(value) for value in values.tolist()]
+            self.assertEqual(expected, utils.format_numbers(values))
+            self.assertEqual([value.replace('.', ',') for value in expected],
+                             utils.format_numbers(values, ','))
+
 
 if __name__ == '__main__':
-    import unittest
     unittest.main()
@@ -0,0 +1,122 @@
+import struct
+import zlib
+import pickle
+
+import unittest
+
+import numpy
+
+# this import is for apycot
+import cubicweb.devtools
+
+from cubes.timeseries import storage
+
+
+class ChunkedStorageTC(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for codec in ('zlib', 'none'):
+            for dtype in (numpy.float64, numpy.int32, numpy.bool_):
+                array = numpy.arange(100).astype(dtype)
+                raw = storage.encode_array(array, chunk_size=16, codec=codec)
+                decoded = storage.decode_array(raw)
+                self.assertEqual(decoded.dtype, array.dtype)
+                self.assertEqual(decoded.tolist(), array.tolist())
+                self.assertFalse(storage.needs_upgrade(raw))
+
+    def test_codecs(self):
+        self.assertEqual(storage.available_codec('zlib'), 'zlib')
+        self.assertEqual(storage.available_codec('unknown'), 'zlib')
+        array = numpy.arange(100, dtype=numpy.float64)
+        for codec in storage.CODECS:
+            raw = storage.encode_array(array, chunk_size=16, codec=codec)
+            self.assertEqual(storage.ChunkedArray(raw).codec, codec)
+            self.assertEqual(storage.decode_array(raw).tolist(), array.tolist())
+
+    def test_unavailable_codec(self):
+        storage.register_codec('test', bytes, bytes)
+        try:
+            raw = storage.encode_array(numpy.arange(10), codec='test')
+        finally:
+            del storage.CODECS['test']
+        self.assertRaises(ValueError, storage.decode_array, raw)
+
+    def test_read_range(self):
+        array = numpy.arange(100, dtype=numpy.int32)
+        stored = storage.ChunkedArray(storage.encode_array(array, chunk_size=16))
+        self.assertEqual(len(stored), 100)
+        self.assertEqual(stored.nchunks, 7)
+        self.assertEqual(stored[20:40].tolist(), array[20:40].tolist())
+        # only chunks 1 and 2 had to be decoded
+        self.assertEqual(sorted(stored._chunks), [1, 2])
+        self.assertEqual(stored[-1], 99)
+        self.assertEqual(stored[90:200].tolist(), array[90:].tolist())
+        self.assertEqual(stored[50:40].tolist(), [])
+        self.assertRaises(IndexError, stored.__getitem__, 100)
+
+    def test_take(self):
+        array = numpy.arange(100, dtype=numpy.int32)
+        stored = storage.ChunkedArray(storage.encode_array(array, chunk_size=16))
+        self.assertEqual(stored[[50, 3, -1, 52]].tolist(), [50, 3, 99, 52])
+        self.assertEqual(sorted(stored._chunks), [0, 3, 6])
+        self.assertEqual(stored[numpy.arange(0, 100, 7)].tolist(),
+                         array[::7].tolist())
+        self.assertRaises(IndexError, stored.__getitem__, [1, 100])
+
+    def test_zero_copy(self):
+        array = numpy.arange(100, dtype=numpy.float64)
+        raw = storage.encode_array(array, chunk_size=16, codec='none')
+        decoded = storage.decode_array(raw)
+        self.assertFalse(decoded.flags.writeable)
+        self.assertFalse(decoded.flags.owndata)
+
+    def test_filters(self):
+        timestamps = 3560 + numpy.arange(100) / 96.
+        timestamps[50:] += 1 / 86400.
+        values = numpy.array([1.5, -2., numpy.nan, numpy.inf, 0.] * 20)
+        extremes = numpy.array([numpy.iinfo(numpy.int64).min, 0,
+                                numpy.iinfo(numpy.int64).max, -1] * 5)
+        for array in (timestamps, values, extremes,
+                      numpy.arange(100, dtype=numpy.int16),
+                      numpy.arange(100) % 3 == 0):
+            for filter in storage.FILTERS:
+                for codec in ('zlib', 'none'):
+                    raw = storage.encode_array(array, chunk_size=16,
+                                               codec=codec, filter=filter)
+                    stored = storage.ChunkedArray(raw)
+                    self.assertEqual(stored.filter, filter)
+                    self.assertEqual(stored.dtype, array.dtype)
+                    self.assertEqual(stored[20:40].tobytes(),
+                                     array[20:40].tobytes())
+                    self.assertEqual(stored[-1].tobytes(), array[-1].tobytes())
+                    self.assertEqual(storage.decode_array(raw).tobytes(),
+                                     array.tobytes())
+        # nearly regular timestamps shrink a lot
+        self.assertLess(len(storage.encode_array(timestamps, filter='dod')),
+                        len(storage.encode_array(timestamps)) / 2)
+
+    def test_choose_filter(self):
+        smooth = numpy.sin(numpy.arange(1000) / 50.)
+        steps = numpy.repeat([1.5, 2.25, 3.75, 0.5], 250)
+        self.assertEqual(storage.choose_filter(smooth, (None, 'xor')), 'xor')
+        self.assertEqual(storage.choose_filter(steps, (None, 'xor')), None)
+        self.assertEqual(storage.choose_filter(steps, ('xor',)), 'xor')
+
+    def test_legacy_pickle(self):
+        array = numpy.arange(10, dtype=numpy.float64)
+        for raw in (pickle.dumps(array, protocol=2),
+                    zlib.compress(pickle.dumps(array, protocol=2))):
+            self.assertTrue(storage.needs_upgrade(raw))
+            stored = storage.ChunkedArray(raw)
+            self.assertEqual(len(stored), 10)
+            self.assertEqual(stored[2:5].tolist(), [2., 3., 4.])
+            self.assertEqual(storage.decode_array(raw).tolist(), array.tolist())
+
+    def test_unsupported_version(self):
+        raw = storage.encode_array(numpy.arange(10))
+        raw = raw[:4] + struct.pack('<B', storage.VERSION + 1) + raw[5:]
+        self.assertTrue(storage.needs_upgrade(raw))
+        self.assertRaises(ValueError, storage.ChunkedArray, raw)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,14 @@
 from __future__ import division
 
+import unittest
 from datetime import datetime, timedelta
 
 import numpy
 
 from cubicweb.devtools.testlib import CubicWebTC
 
+from cubes.timeseries import cache
+from cubes.timeseries.entities import utils
 from cubes.timeseries.entities.utils import get_next_date
 
 
@@ -52,6 +55,12 @@ class NPTSTC(TimeSeriesTC):
             ts3 = self._create_ts(cnx, granularity=u'daily')
             self.assertEqual(ts3.timestamped_array(), ts.timestamped_array())
 
+    def test_datetime64_timestamps(self):
+        with self.admin_access.repo_cnx() as cnx:
+            ts = self._create_npts(cnx)
+            ts2 = self._create_npts(cnx, timestamps=ts.date_index())
+            self.assertEqual(ts2.timestamped_array(), ts.timestamped_array())
+
     def test_no_timestamps(self):
         with self.admin_access.repo_cnx() as cnx:
             with self.assertRaises(ValueError) as cm:
@@ -115,6 +124,26 @@ class TSaccessTC(TimeSeriesTC):
         expected_end = datetime(2019, 10, 1)
         self.assertEqual(self.yearlyts.end_date, expected_end)
 
+    def test_date_index_monthly_end_of_month(self):
+        with self.admin_access.repo_cnx() as cnx:
+            ts = self._create_ts(cnx, granularity=u'monthly', data=numpy.arange(14),
+                                 start_date=datetime(2012, 1, 31, 6))
+            expected = [datetime(2012, 1, 31, 6)]
+            for _i in range(13):
+                expected.append(get_next_date('monthly', expected[-1]))
+            self.assertEqual(ts.date_index().tolist(), expected)
+            self.assertEqual(ts.date_index()[2].tolist(), datetime(2012, 3, 29, 6))
+
+    def test_end_date_monthly_end_of_month(self):
+        with self.admin_access.repo_cnx() as cnx:
+            ts = self._create_ts(cnx, granularity=u'monthly', data=numpy.arange(60),
+                                 start_date=datetime(2012, 1, 31, 6))
+            date = ts.start_date
+            for _i in range(60):
+                date = get_next_date('monthly', date)
+            self.assertEqual(ts.end_date, date)
+            self.assertEqual(ts.end_date, datetime(2017, 1, 28, 6))
+
     def test_make_relative_index_constant(self):
         ts = self.constantts
         date = datetime(2009, 10, 2, 12)
@@ -345,6 +374,63 @@ class TSaccessTC(TimeSeriesTC):
         expected = (.75*self.dailyts.array[1] + 1*self.dailyts.array[2] + 1*self.dailyts.array[3])
         self.assertEqual(result, expected)
 
+    def test_aggregated_values(self):
+        intervals = [(datetime(2009, 10, 2, 6), datetime(2009, 10, 4, 6)),
+                     (datetime(2009, 10, 1), datetime(2009, 10, 9, 12)),
+                     (datetime(2009, 10, 2, 6), datetime(2009, 10, 2, 18))]
+        for mode in self.dailyts.supported_modes:
+            expected = [self.dailyts.aggregated_value([interval], mode)[1]
+                        for interval in intervals]
+            result = self.dailyts.aggregated_values(intervals, mode)
+            self.assertEqual(result.tolist(), expected)
+        result = self.dailyts.aggregated_values(numpy.array(intervals, dtype='datetime64[us]'),
+                                                'sum')
+        self.assertEqual(result.tolist(), [self.dailyts.aggregated_value([interval], 'sum')[1]
+                                           for interval in intervals])
+
+    def test_aggregated_values_empty_interval(self):
+        intervals = [(datetime(2009, 10, 2, 6), datetime(2009, 10, 4, 6)),
+                     (datetime(2009, 9, 2), datetime(2009, 9, 3))]
+        self.assertRaises(IndexError, self.dailyts.aggregated_values, intervals, 'sum')
+
+    def test_get_values_between(self):
+        dates, values = self.dailyts.get_values_between(datetime(2009, 10, 3, 12),
+                                                        datetime(2009, 10, 6))
+        self.assertEqual(dates.tolist(), [datetime(2009, 10, 4), datetime(2009, 10, 5)])
+        self.assertEqual(values.tolist(), [3, 4])
+        dates, values = self.monthlyts.get_values_between(datetime(2010, 1, 15), None)
+        self.assertEqual(dates[0].tolist(), datetime(2010, 2, 1))
+        self.assertEqual(values.tolist(), list(range(4, 10)))
+        dates, values = self.monthlyts.get_values_between(datetime(2011, 1, 1), None)
+        self.assertEqual((len(dates), len(values)), (0, 0))
+
+    def test_get_values_between_constant(self):
+        dates, values = self.constantts.get_values_between(datetime(2009, 10, 3), None)
+        self.assertEqual(dates.tolist(), [datetime(2009, 10, 3)])
+        self.assertEqual(values.tolist(), [0])
+
+    def test_resample(self):
+        with self.admin_access.repo_cnx() as cnx:
+            dailyts = cnx.entity_from_eid(self.dailyts.eid)
+            # first week partly covered
+            intervals = [(datetime(2009, 10, 1), datetime(2009, 10, 5)),
+                         (datetime(2009, 10, 5), dailyts.end_date)]
+            for mode in dailyts.supported_modes:
+                weeklyts = dailyts.resample('weekly', mode)
+                self.assertEqual(weeklyts.granularity, 'weekly')
+                self.assertEqual(weeklyts.start_date, datetime(2009, 9, 28))
+                self.assertFalse(weeklyts.cw_is_saved())
+                expected = [dailyts.aggregated_value([interval], mode)[1]
+                            for interval in intervals]
+                self.assertEqual(weeklyts.array.tolist(), expected)
+
+    def test_resample_constant(self):
+        self.assertRaises(ValueError, self.constantts.resample, 'daily', 'average')
+
+    def test_resample_not_coarser(self):
+        for granularity in ('15min', 'daily', 'constant'):
+            self.assertRaises(ValueError, self.dailyts.resample, granularity, 'average')
+
 
 class NPTSaccessTC(TSaccessTC):
     """same test as above but for NonPeriodicTimeSeries"""
@@ -356,6 +442,14 @@ class NPTSaccessTC(TSaccessTC):
     test_get_by_date_constant = test_end_date_constant
     test_get_by_date_constant_slice = test_end_date_constant
     test_get_by_date_constant_slice_none = test_end_date_constant
+    test_resample_constant = test_end_date_constant
+    test_get_values_between_constant = test_end_date_constant
+    # the end date of a non periodic time series is its last time stamp
+    test_end_date_monthly_end_of_month = test_end_date_constant
+
+    def test_resample_not_coarser(self):
+        # non periodic time series may be resampled to any granularity
+        self.assertRaises(ValueError, self.dailyts.resample, 'constant', 'average')
 
     def test_end_date_daily(self):
         expected_end = self.dailyts.start_date + timedelta(days=9)
@@ -408,6 +502,16 @@ class NPTSaccessTC(TSaccessTC):
         delta = calendar.get_offset(date, granularity) - self.monthlyts._start_offset
         self.assertAlmostEqual(delta, 32.5)
 
+    def test_lookups(self):
+        date = datetime(2009, 10, 3, 12)
+        self.assertEqual(self.dailyts.get_offset(date), 3)
+        self.assertEqual(self.dailyts.get_rel_index(date), 2)
+        self.assertEqual(self.dailyts.get_next_date(date), datetime(2009, 10, 4))
+        self.assertEqual(self.dailyts.get_frac_offset(date), .5)
+        self.assertEqual(self.dailyts.get_duration_in_days(date), 1)
+        self.assertEqual(self.dailyts.get_rel_indexes([date, datetime(2009, 10, 4)]).tolist(),
+                         [2, 3])
+
     def test_offset_for_granularity_with_dash(self):
         date = datetime(2009, 10, 5, 0)
         calendar = self.yearlyts.calendar
@@ -476,6 +580,35 @@ class ComputeSumAverageTC(TimeSeriesTC):
         # expected = (data[1] + data[2] + data[3]) / (3.)
         self.assertAlmostEqual(average,  expected)
 
+    def test_monthly_weighted_average(self):
+        start_date = datetime(2009, 10, 16, 0)
+        end_date = datetime(2010, 8, 11, 0)
+        _date, average = self.monthlyts.aggregated_value([(start_date, end_date)],
+                                                         'weighted_average')
+        data = self.monthlyts.array
+        days = numpy.array([31, 30, 31, 31, 28, 31, 30, 31, 30, 31, 31])
+        coefs = numpy.ones(11)
+        coefs[0] = 16/31
+        coefs[-1] = 10/31
+        expected = (coefs*days*data[:11]).sum()/(coefs*days).sum()
+        self.assertAlmostEqual(average, expected)
+
+    def test_sums_without_prefix_sums(self):
+        intervals = [(datetime(2009, 10, 16), datetime(2010, 1, 11)),
+                     (datetime(2010, 2, 1), datetime(2010, 8, 11))]
+        cache.ARRAY_CACHE.clear()
+        expected = {}
+        for mode in ('sum', 'average', 'weighted_average'):
+            expected[mode] = self.monthlyts.aggregated_value(intervals, mode)
+        # a few intervals are summed from their values only
+        for key in ('data-cumsum', 'data-wcumsum', 'weights-cumsum'):
+            self.assertNotIn(self.monthlyts._array_cache_key(key), cache.ARRAY_CACHE)
+        for mode in ('sum', 'average', 'weighted_average'):
+            self.monthlyts.aggregated_values(intervals, mode)
+            self.assertTrue(self.monthlyts._prefix_sums_cached(mode == 'weighted_average'))
+            _date, value = self.monthlyts.aggregated_value(intervals, mode)
+            self.assertAlmostEqual(value, expected[mode][1])
+
     def test_monthly_average2(self):
         start_date = datetime(2009, 11, 3, 0)
         end_date = datetime(2009, 11, 23, 0)
@@ -568,6 +701,120 @@ class NPTSComputeSumAverageTC(ComputeSumAverageTC):
         self.skipTest('need update for non-periodic time-series')
 
 
+class RollupTC(TimeSeriesTC):
+
+    def test_rollups(self):
+        with self.admin_access.repo_cnx() as cnx:
+            # october and november 2009
+            ts = self._create_ts(cnx, granularity=u'hourly', data=numpy.arange(61*24))
+            cnx.commit()
+            rollups = ts.rollups()
+            self.assertEqual([rollup.granularity for rollup in rollups], ['monthly', 'daily'])
+            monthly = rollups[0]
+            self.assertEqual(monthly.start_date, datetime(2009, 10, 1))
+            self.assertEqual(monthly.get_array('counts').tolist(), [31*24, 30*24])
+            self.assertEqual(monthly.get_array('max_values').tolist(), [31*24 - 1, 61*24 - 1])
+            intervals = [(datetime(2009, 10, 1), datetime(2009, 11, 1))]
+            self.assertEqual(ts.aggregated_value(intervals, 'sum'),
+                             (datetime(2009, 10, 1), sum(range(31*24))))
+            self.assertEqual(ts.aggregated_value(intervals, 'min'),
+                             (datetime(2009, 10, 1), 0))
+            keys = [monthly._array_cache_key(attr) for attr in ('counts', 'max_values')]
+            for key in keys:
+                self.assertIn(key, cache.ARRAY_CACHE)
+            ts.cw_set(data=numpy.arange(61*24) * 2)
+            cnx.commit()
+            # the former tiers are not served anymore
+            for key in keys:
+                self.assertNotIn(key, cache.ARRAY_CACHE)
+            ts.cw_clear_all_caches()
+            self.assertEqual(ts.rollups()[0].get_array('max_values').tolist(),
+                             [2 * (31*24 - 1), 2 * (61*24 - 1)])
+            self.assertEqual(len(cnx.execute('Any R WHERE R is TimeSeriesRollup')), 2)
+
+    def test_rollups_after_update(self):
+        with self.admin_access.repo_cnx() as cnx:
+            ts = self._create_ts(cnx, granularity=u'hourly', data=numpy.arange(4*24))
+            cnx.commit()
+            # cached dates must not outlive the former values
+            self.assertEqual(ts.end_date, datetime(2009, 10, 5))
+            ts.cw_set(data=numpy.arange(6*24))
+            cnx.commit()
+            self.assertEqual(ts.end_date, datetime(2009, 10, 7))
+            daily = ts.rollups()[-1]
+            self.assertEqual(daily.granularity, 'daily')
+            self.assertEqual(daily.count, 6)
+            intervals = [(datetime(2009, 10, 5), datetime(2009, 10, 7))]
+            self.assertEqual(ts.aggregated_value(intervals, 'sum'),
+                             (datetime(2009, 10, 5), sum(range(4*24, 6*24))))
+
+
+class ArrayCacheTC(TimeSeriesTC):
+
+    def test_shared_array(self):
+        with self.admin_access.repo_cnx() as cnx:
+            eid = self._create_ts(cnx, granularity=u'daily').eid
+            cnx.commit()
+        with self.admin_access.repo_cnx() as cnx:
+            array = cnx.entity_from_eid(eid).array
+            self.assertEqual(array.tolist(), list(range(10)))
+            self.assertFalse(array.flags.writeable)
+        hits = cache.ARRAY_CACHE.hits
+        with self.admin_access.repo_cnx() as cnx:
+            self.assertEqual(cnx.entity_from_eid(eid).array.tolist(),
+                             list(range(10)))
+        self.assertEqual(cache.ARRAY_CACHE.hits, hits + 1)
+        with self.admin_access.repo_cnx() as cnx:
+            cnx.entity_from_eid(eid).cw_set(data=numpy.arange(5))
+            cnx.commit()
+        with self.admin_access.repo_cnx() as cnx:
+            self.assertEqual(cnx.entity_from_eid(eid).array.tolist(),
+                             list(range(5)))
+
+
+class PlotRangeTC(TimeSeriesTC):
+
+    def test_range_points(self):
+        with self.admin_access.web_request() as req:
+            ts = self._create_ts(req.cnx, granularity=u'hourly', data=numpy.arange(1000))
+            req.cnx.commit()
+            view = self.vreg['views'].select('ts_plot', req, rset=ts.as_rset())
+            points = view.range_points(ts, datetime(2009, 10, 2), datetime(2009, 10, 3), 700)
+            # steps, as the initial plot
+            self.assertEqual(points[:3], [(1254441600000, 24), (1254445199000, 24),
+                                          (1254445200000, 25)])
+            self.assertEqual(sorted(set(value for _ticks, value in points)), list(range(24, 48)))
+            self.assertEqual(points[-1], (1254528000000, 47))
+            points = view.range_points(ts, datetime(2000, 1, 1), datetime(2030, 1, 1), 100)
+            self.assertEqual(len(points), 100)
+            self.assertEqual([points[0][1], points[-1][1]], [0, 999])
+            self.assertEqual(view.range_points(ts, datetime(2030, 1, 1),
+                                               datetime(2031, 1, 1), 100), [])
+
+
+class DownsamplingTC(unittest.TestCase):
+
+    def test_lttb(self):
+        x = numpy.arange(10.)
+        y = numpy.array([0, 1, 0, 0, 5, 0, 0, -3, 0, 0.])
+        self.assertEqual(utils.lttb_indexes(x, y, 4).tolist(), [0, 4, 7, 9])
+        self.assertEqual(utils.lttb_indexes(x, y, 10).tolist(), list(range(10)))
+        y = numpy.random.rand(10000)
+        indexes = utils.lttb_indexes(numpy.arange(10000.), y, 700)
+        self.assertEqual(len(indexes), 700)
+        self.assertTrue((numpy.diff(indexes) > 0).all())
+
+    def test_minmax(self):
+        y = numpy.array([5, 1, 9, 3, 3, 7, 0, 2, 8, 4.])
+        self.assertEqual(utils.minmax_indexes(y, 3).tolist(),
+                         [0, 1, 2, 3, 5, 6, 8, 9])
+        self.assertEqual(utils.minmax_indexes(y, 4).tolist(), list(range(10)))
+
+    def test_ticks(self):
+        dates = [datetime(1960, 5, 3, 1, 2, 3, 456789), datetime(2020, 1, 1)]
+        self.assertEqual(utils.datetimes_to_ticks(dates).tolist(),
+                         [-304988276544, 1577836800000])
+
+
 if __name__ == '__main__':
-    import unittest
     unittest.main()
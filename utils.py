@@ -33,3 +33,15 @@ def get_formatter(req, entity):
         numformatter = lambda x:req.format_float(x)
         numformat = '%s'
     return dateformat, numformat, numformatter
+
+
+# strftime directives and their excel number format counterpart
+EXCEL_DATE_CODES = (('%Y', 'YYYY'), ('%m', 'MM'), ('%d', 'DD'),
+                    ('%H', 'HH'), ('%M', 'MM'), ('%S', 'SS'))
+
+def excel_date_format(dateformat):
+    """ return the excel number format displaying dates as the strftime
+    `dateformat` does, as far as its directives are known """
+    for directive, code in EXCEL_DATE_CODES:
+        dateformat = dateformat.replace(directive, code)
+    return dateformat
@@ -1,8 +1,17 @@
+import os.path as osp
+import zipfile
+from functools import reduce
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
 from cubicweb import _
-from cubicweb.predicates import is_instance, one_line_rset
+from cubicweb.predicates import is_instance, one_line_rset, multi_lines_rset
 from cubicweb.view import EntityView
 from cubicweb.web import action
 
+from cubes.timeseries.entities import utils
+
 class TimeSeriesExcelExport(EntityView):
     __regid__ = 'tsxlexport'
     __select__ = is_instance('TimeSeries', 'NonPeriodicTimeSeries')
@@ -23,13 +32,169 @@ class TimeSeriesExcelExport(EntityView):
         entity = self.cw_rset.get_entity(0, 0)
         exporter = self._cw.vreg['adapters'].select('ITimeSeriesExporter', self._cw,
                                                     entity=entity, mimetype=self.content_type)
-        self.w(exporter.export())
+        # write blocks as they are produced rather than one big string
+        for block in exporter.export_blocks():
+            self.w(block)
 
 class TimeSeriesCSVExport(TimeSeriesExcelExport):
     __regid__ = 'tscsvexport'
     content_type = 'text/csv'
     file_ext = 'csv'
 
+class TimeSeriesNPYExport(TimeSeriesExcelExport):
+    __regid__ = 'tsnpyexport'
+    content_type = 'application/x-npy'
+    file_ext = 'npy'
+
+class TimeSeriesArrowExport(TimeSeriesExcelExport):
+    __regid__ = 'tsarrowexport'
+    content_type = 'application/vnd.apache.arrow.file'
+    file_ext = 'arrow'
+
+class TimeSeriesParquetExport(TimeSeriesExcelExport):
+    __regid__ = 'tsparquetexport'
+    content_type = 'application/vnd.apache.parquet'
+    file_ext = 'parquet'
+
+class _ViewStream(object):
+    """ write only file object forwarding data to a view, for zipfile """
+
+    def __init__(self, w):
+        self.w = w
+        self.position = 0
+
+    def write(self, data):
+        self.w(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+class TimeSeriesBulkExportMixin(object):
+    """ export all the time series of the result set at once
+
+    The data of at most twice `workers` series is fetched at once from the
+    database, then decoded and formatted by a pool of `workers` threads, and
+    released once the results of these series are consumed.
+    """
+    workers = 4
+
+    def prefetch(self, entities):
+        """ load what the exports need from the database, which can't be
+        queried from the worker threads """
+        byeid = dict((entity.eid, entity) for entity in entities)
+        eids = ','.join(str(eid) for eid in byeid)
+        for entity in entities:
+            entity.complete()
+        for eid, data in self._cw.execute('Any X,D WHERE X data D, X eid IN (%s)' % eids):
+            byeid[eid].cw_attr_cache['data'] = data
+        for eid, tstamps in self._cw.execute('Any X,T WHERE X timestamps T, '
+                                             'X eid IN (%s)' % eids):
+            byeid[eid].cw_attr_cache['timestamps'] = tstamps
+        # cached by the user entity
+        self._cw.user.format_preferences
+        self._cw.property_value('ui.date-format')
+
+    def release(self, entities):
+        """ drop the data and the caches of the given entities """
+        for entity in entities:
+            entity.cw_attr_cache.pop('data', None)
+            entity.cw_attr_cache.pop('timestamps', None)
+            entity.cw_clear_all_caches()
+
+    def imap(self, function, entities):
+        """ yield function(entity) for each entity, computed in the pool of
+        threads by windows of twice `workers` entities """
+        pool = ThreadPool(self.workers)
+        try:
+            window = 2 * self.workers
+            for start in range(0, len(entities), window):
+                chunk = entities[start:start + window]
+                self.prefetch(chunk)
+                for result in pool.map(function, chunk):
+                    yield result
+                self.release(chunk)
+        finally:
+            pool.terminate()
+
+class TimeSeriesZipExport(TimeSeriesBulkExportMixin, EntityView):
+    """ zip of one file per time series, in the format of the `mimetype`
+    form parameter (csv by default) """
+    __regid__ = 'tszipexport'
+    __select__ = is_instance('TimeSeries', 'NonPeriodicTimeSeries')
+    content_type = 'application/zip'
+    templatable = False
+    binary = True
+
+    def set_request_content_type(self):
+        self._cw.set_content_type(self.content_type, filename='timeseries.zip')
+
+    def call(self, **kwargs):
+        mimetype = self._cw.form.get('mimetype', 'text/csv')
+        entities = list(self.cw_rset.entities())
+        exporters = dict((entity.eid, self._cw.vreg['adapters'].select(
+            'ITimeSeriesExporter', self._cw, entity=entity, mimetype=mimetype))
+                         for entity in entities)
+        def export(entity):
+            return exporters[entity.eid].export()
+        # members are sent as soon as they are compressed
+        archive = zipfile.ZipFile(_ViewStream(self.w), 'w', zipfile.ZIP_DEFLATED)
+        for index, data in enumerate(self.imap(export, entities)):
+            eid = entities[index].eid
+            ext = osp.splitext(exporters.pop(eid).filename)[1]
+            archive.writestr('ts_%s%s' % (eid, ext), data)
+        archive.close()
+
+class TimeSeriesWideExport(TimeSeriesBulkExportMixin, EntityView):
+    """ csv table of the time series, one column per series, aligned on the
+    union of their dates """
+    __regid__ = 'tswideexport'
+    __select__ = is_instance('TimeSeries', 'NonPeriodicTimeSeries')
+    content_type = 'text/csv'
+    templatable = False
+    binary = True
+    # number of rows formatted at once
+    block_size = 64 * 1024
+
+    def set_request_content_type(self):
+        self._cw.set_content_type(self.content_type, filename='timeseries.csv')
+
+    def call(self, **kwargs):
+        req = self._cw
+        entities = list(self.cw_rset.entities())
+        dec_sep = req.user.format_preferences[0].decimal_separator
+        def column(entity):
+            return (entity.dc_title(), entity.date_index(),
+                    entity._output_array(entity.array))
+        # only the dates and values arrays are kept, the values are formatted
+        # by blocks of rows
+        columns = list(self.imap(column, entities))
+        dates = reduce(numpy.union1d, [series_dates for _title, series_dates, _values in columns])
+        if (dates != dates.astype('datetime64[D]')).any():
+            dateformat = req.property_value('ui.datetime-format')
+        else:
+            dateformat = req.property_value('ui.date-format')
+        header = [req._('date')] + [title for title, _dates, _values in columns]
+        self.w(('\t'.join(header) + '\r\n').encode('utf-8'))
+        for start in range(0, len(dates), self.block_size):
+            block = dates[start:start + self.block_size]
+            cells = []
+            for _title, series_dates, values in columns:
+                first = numpy.searchsorted(series_dates, block[0])
+                stop = numpy.searchsorted(series_dates, block[-1], side='right')
+                # blank cells where the series has no value
+                column = numpy.empty(len(block), dtype=object)
+                column[:] = u''
+                column[numpy.searchsorted(block, series_dates[first:stop])] = \
+                    utils.format_numbers(values[first:stop], dec_sep)
+                cells.append(column.tolist())
+            strdates = utils.format_datetimes(block, dateformat)
+            rows = '\r\n'.join(map('\t'.join, zip(strdates, *cells)))
+            self.w((rows + '\r\n').encode('utf-8'))
+
 class ExcelTSExportAction(action.Action):
     __regid__ = 'tsexportaction'
     title = _('export to excel')
@@ -38,3 +203,18 @@ class ExcelTSExportAction(action.Action):
     def url(self):
         return self.cw_rset.get_entity(0, 0).absolute_url(vid='tsxlexport')
 
+class ZipTSExportAction(action.Action):
+    __regid__ = 'tszipexportaction'
+    title = _('export to zip')
+    __select__ = multi_lines_rset() & is_instance('TimeSeries', 'NonPeriodicTimeSeries')
+
+    def url(self):
+        return self._cw.build_url(rql=self.cw_rset.printable_rql(), vid='tszipexport')
+
+def registration_callback(vreg):
+    skipped = []
+    if not utils.HANDLE_ARROW:
+        skipped.append(TimeSeriesArrowExport)
+    if not utils.HANDLE_PARQUET:
+        skipped.append(TimeSeriesParquetExport)
+    vreg.register_all(list(globals().values()), __name__, skipped)
@@ -9,10 +9,12 @@ from __future__ import division
 
 import numpy
 
-from cubicweb import Binary, ValidationError, tags, _
+from cubicweb import ValidationError, tags, _
 from cubicweb.web.views import uicfg
 from cubicweb.web import formwidgets as fw, formfields as ff
 
+from cubes.timeseries.entities import utils
+
 # XXX hack to work around https://www.cubicweb.org/ticket/1381203
 
 class DataFileField(ff.FileField):
@@ -49,13 +51,11 @@ class DataFileField(ff.FileField):
             filename, stream = value
         except ValueError:
             raise ff.UnmodifiedField()
-        # XXX avoid in memory loading of posted files. Requires Binary handling changes...
-        value = Binary(stream.read())
-        if not value.getvalue(): # usually an unexistant file
+        # spool posted files to disk, converters read them by chunks
+        value = utils.UploadedFile.spool(stream, ff.normalize_filename(filename))
+        if not value.size: # usually an unexistant file
+            value.close()
             value = None
-        else:
-            # set filename on the Binary instance, may be used later in hooks
-            value.filename = ff.normalize_filename(filename)
         return value
 
 def __new__(cls, *args, **kwargs):
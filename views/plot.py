@@ -7,7 +7,8 @@
 """
 from __future__ import division
 
-from logilab.common.date import datetime2ticks
+import numpy
+
 from logilab.mtconverter import xml_escape
 
 from cwtags import tag as t
@@ -15,18 +16,73 @@ from cubicweb import _
 from cubicweb.utils import json_dumps as dumps
 from cubicweb.predicates import is_instance, score_entity
 from cubicweb.web.views import baseviews
+from cubicweb.web.views.ajaxcontroller import ajaxfunc
+
+from cubes.timeseries.entities import utils
 
 
 class TimeSeriesPlotView(baseviews.EntityView):
     __regid__ = 'ts_plot'
     __select__ = is_instance('TimeSeries', 'NonPeriodicTimeSeries') & score_entity(lambda x: not x.is_constant)
     title = None
-    onload = u"init_ts_plot('%(figid)s', [%(plotdata)s]);"
+    onload = u"init_ts_plot('%(figid)s', [%(plotdata)s], %(urls)s, %(points)s);"
+    # time series with more values are plotted from their finest rollup tier
+    # holding at most that many periods, if any
+    max_points = 5000
+    # the page holds an overview of a fraction of the width of the plot in
+    # pixels, zooming fetches at most about one point per pixel of the range
+    overview_ratio = 4
+    # 'lttb' keeps the points of largest triangles (Largest-Triangle-Three-
+    # Buckets), 'minmax' the minimum and maximum of each bucket
+    downsampling = 'lttb'
+
+    def plot_points(self, ts):
+        """ return the datetime64 array of the dates and the array of the
+        values to plot """
+        if ts.count > self.max_points:
+            for rollup in reversed(ts.rollups()):
+                if rollup.count <= self.max_points:
+                    # plot the average value of each period of the rollup tier
+                    return rollup.date_index(), rollup.averages()
+        return self.step_points(ts, None, None)
+
+    def step_points(self, ts, start, end):
+        """ return the datetime64 array of the dates and the array of the
+        values of the steps drawing the time series within [start, end), None
+        bounds standing for its start and end; only the values of the range
+        are read """
+        if end is None or end >= ts.end_date:
+            # open ended, to keep the last time stamp of non periodic series
+            end = None
+        dates, values = ts.get_values_between(start, end)
+        return utils.step_points(dates, values, end or ts.end_date)
+
+    def dump_plot(self, ts, points=None):
+        return self.dump_points(*self.plot_points(ts), points=points)
 
-    def dump_plot(self, ts):
-        plot = [(datetime2ticks(x), y)
-                for x,y in ts.compressed_timestamped_array()]
-        return dumps(plot)
+    def dump_points(self, dates, values, points=None):
+        """ return the json list of the (ticks, value) points, downsampled to
+        about `points` points if given """
+        return dumps(self.downsample(dates, values, points))
+
+    def downsample(self, dates, values, points=None):
+        """ return the list of the (ticks, value) points, downsampled to about
+        `points` points if given """
+        ticks = utils.datetimes_to_ticks(dates)
+        values = numpy.asarray(values)
+        if points:
+            if self.downsampling == 'minmax':
+                indexes = utils.minmax_indexes(values, points // 2)
+            else:
+                indexes = utils.lttb_indexes(ticks, values, points)
+            ticks, values = ticks[indexes], values[indexes]
+        return list(zip(ticks.tolist(), values.tolist()))
+
+    def range_points(self, ts, start, end, points):
+        """ return the list of the (ticks, value) points of the time series
+        dated within [start, end), downsampled to about `points` points; only
+        the values of the range are read """
+        return self.downsample(*self.step_points(ts, start, end), points=points)
 
     def call(self, width=None, height=None):
         req = self._cw; w=self.w
@@ -35,14 +91,33 @@ class TimeSeriesPlotView(baseviews.EntityView):
         req.add_js(('jquery.flot.js',
                     'jquery.flot.selection.js',
                     'cubes.timeseries.js'))
-        width = width or req.form.get('width', 700)
-        height = height or req.form.get('height', 400)
+        width = int(width or req.form.get('width', 700))
+        height = int(height or req.form.get('height', 400))
         figid = u'figure%s' % req.varmaker.next()
         w(t.div(u'', id='main%s' % figid, style='width: %spx; height: %spx;' % (width, height)))
         w(t.div(u'', id='overview%s' % figid, style='width: %spx; height: %spx;' % (width, height/3)))
         w(t.button(req._('Zoom reset'), id='reset', klass='validateButton'))
-        plotdata = ("{label: '%s', data: %s}" % (xml_escape(ts.dc_title()), self.dump_plot(ts))
-                    for ts in self.cw_rset.entities())
+        plotdata, urls = [], []
+        for ts in self.cw_rset.entities():
+            plotdata.append("{label: '%s', data: %s}" % (
+                xml_escape(ts.dc_title()),
+                self.dump_plot(ts, width // self.overview_ratio)))
+            urls.append(ts.absolute_url('json') + '&fname=get_ts_plot_data')
         req.html_headers.add_onload(self.onload %
                                     {'figid': figid,
-                                     'plotdata': ','.join(plotdata)})
+                                     'plotdata': ','.join(plotdata),
+                                     'urls': dumps(urls),
+                                     'points': width})
+
+
+@ajaxfunc(output_type='json')
+def get_ts_plot_data(self):
+    """ points of the time series between the `start` and `end` ticks
+    (milliseconds since the epoch), downsampled to about `points` points """
+    form = self._cw.form
+    rset = self._cw.execute(form.get('rql'))
+    view = self._cw.vreg['views'].select('ts_plot', self._cw, rset=rset)
+    start, end = [numpy.datetime64(int(float(form.get(bound))), 'ms').tolist()
+                  for bound in ('start', 'end')]
+    return view.range_points(rset.get_entity(0, 0), start, end,
+                             int(form.get('points', 700)))
@@ -10,16 +10,19 @@ from __future__ import division
 import math
 import datetime
 
+import numpy
+
 from logilab.mtconverter import xml_escape
 
 from cwtags import tag as t
 
 from cubicweb import _
 from cubicweb.schema import display_name
-from cubicweb.predicates import is_instance
+from cubicweb.predicates import is_instance, match_user_groups
 from cubicweb.web.views import primary, baseviews, tabs
 from cubicweb.web.views.ajaxcontroller import ajaxfunc
 
+from cubes.timeseries import cache
 from cubes.timeseries.utils import get_formatter
 
 
@@ -125,25 +128,42 @@ def get_ts_values_data(self):
     rows = int(form.get('rows'))
     sortcol = ['date', 'value'].index(form.get('sidx'))
     reversesortorder = form.get('sord') == 'desc'
-    def sortkey(col):
-        return col[sortcol]
     entity = self._cw.execute(form.get('rql')).get_entity(0,0)
     dateformat, numformat, numformatter = get_formatter(self._cw, entity)
+    # sort indexes rather than (date, value) tuples, then only format the
+    # requested page; dates are already sorted
+    count = entity.count
+    if sortcol == 0:
+        order = numpy.arange(count)
+        if reversesortorder:
+            order = order[::-1]
+    elif reversesortorder:
+        # keep original order of equal values, as sorted(reverse=True) does
+        order = count - 1 - numpy.argsort(entity.array[::-1], kind='mergesort')[::-1]
+    else:
+        order = numpy.argsort(entity.array, kind='mergesort')
+    start = (page - 1)  * rows
+    end = page * rows
+    page_order = order[start:end]
+    dates = entity.date_index()[page_order].tolist()
+    page_values = entity.output_values(entity.array[page_order])
     # build output
     values = [{'id': str(idx + 1),
                'cell': (date.strftime(dateformat), numformat % numformatter(value))}
-               for idx, (date, value) in enumerate(sorted(entity.timestamped_array(),
-                                                          reverse=reversesortorder,
-                                                          key=sortkey))]
-    start = (page - 1)  * rows
-    end = page * rows
-    out = {'total': str(math.ceil(len(values) / rows)),
+              for idx, date, value in zip(range(start, end), dates, page_values)]
+    out = {'total': str(math.ceil(count / rows)),
            'page': page,
-           'records': str(len(values)),
-           'rows': values[start:end]}
+           'records': str(count),
+           'rows': values}
     return out
 
 
+@ajaxfunc(output_type='json', selector=match_user_groups('managers'))
+def get_ts_cache_stats(self):
+    """ usage statistics of the decoded arrays cache of this process """
+    return cache.ARRAY_CACHE.stats()
+
+
 class TimeSeriesValuesView(baseviews.EntityView):
     __regid__ = 'ts_values'
     __select__ = is_instance('TimeSeries', 'NonPeriodicTimeSeries')